@@ -0,0 +1,246 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, BinaryIO, Dict, Iterator, Optional, Tuple
+
+from starlette.responses import FileResponse
+
+from metrics import log_event
+
+# THE WAREHOUSE: FINISHED ZIP ARTIFACTS
+# /refine zips are stored on disk as they stream, keyed by (upload content
+# hash and filter, batch start and batch rule, refinery options, render salt).
+# Every part is known before the upload is parsed, so a repeat request, or a
+# download resumed with Range, is served straight from the file: no parse,
+# no render, no deflate.
+#
+#   build      every stored zip carries a build id; its ETag is "<key>-<build>",
+#              so If-Range only resumes against the exact bytes the client has
+#   abandoned  a download cut off mid-stream is finished in the background
+#              (up to max_finishing at a time) so the resume finds it on disk
+#   first wins concurrent builds of one key keep the first completed file
+#
+# Layout: <root>/<key[:2]>/<key>-<build>.zip, pruned oldest-first past max_bytes,
+# with the build's metadata (e.g. where the next batch starts) in a .json beside it.
+
+PRUNE_EVERY = 16
+KEY = re.compile(r"[0-9a-f]{40}")
+
+
+class Artifact:
+    def __init__(self, key: str, build: str, path: str, meta: Optional[Dict[str, Any]] = None):
+        self.key = key
+        self.build = build
+        self.path = path
+        # Small facts about the build that a hit must answer with; set before it is recorded
+        self.meta: Dict[str, Any] = meta or {}
+
+    @property
+    def meta_path(self) -> str:
+        return self.path[:-len(".zip")] + ".json"
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.key}-{self.build}"'
+
+
+class ArtifactResponse(FileResponse):
+    """FileResponse whose ETag (and If-Range check) is the artifact's build, not the file's stat."""
+
+    def __init__(self, artifact: Artifact, **kwargs: Any):
+        self.etag = artifact.etag
+        headers = {**kwargs.pop("headers", {}), "etag": self.etag}
+        super().__init__(artifact.path, headers=headers, **kwargs)
+
+    def _should_use_range(self, http_if_range: str, stat_result: os.stat_result) -> bool:
+        return http_if_range == self.etag
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+class ArtifactCache:
+    def __init__(self, root: str = "artifacts", max_bytes: int = 2 * 1024 * 1024 * 1024, salt: str = "", max_finishing: int = 4):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.salt = salt
+        self.max_finishing = max_finishing
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.finished_abandoned = 0
+        self.discarded = 0
+        self._finishing = 0
+        self._lock = threading.Lock()
+        self._finisher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="artifacts")
+
+    def key(self, content_hash: str, batch: Tuple[int, ...], options: Dict[str, Any]) -> str:
+        material = json.dumps([self.salt, content_hash, list(batch), options], sort_keys=True, default=str)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()[:40]
+
+    def _shard(self, key: str) -> str:
+        return os.path.join(self.root, key[:2])
+
+    def _find(self, key: str) -> Optional[Artifact]:
+        try:
+            names = sorted(n for n in os.listdir(self._shard(key)) if n.startswith(key + "-") and n.endswith(".zip"))
+        except OSError:
+            return None
+        if not names:
+            return None
+        build = names[0][len(key) + 1:-len(".zip")]
+        artifact = Artifact(key, build, os.path.join(self._shard(key), names[0]))
+        try:
+            with open(artifact.meta_path, encoding="utf-8") as f:
+                artifact.meta = json.load(f)
+        except (OSError, ValueError):
+            pass
+        return artifact
+
+    def get(self, key: str) -> Optional[Artifact]:
+        # Keys arrive in URLs; anything that is not one of ours never touches the filesystem
+        artifact = self._find(key) if KEY.fullmatch(key) else None
+        with self._lock:
+            if artifact is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if artifact is not None:
+            try:
+                # Recency for oldest-first pruning
+                os.utime(artifact.path)
+            except OSError:
+                return None
+        return artifact
+
+    def new_build(self, key: str) -> Artifact:
+        build = uuid.uuid4().hex[:12]
+        return Artifact(key, build, os.path.join(self._shard(key), f"{key}-{build}.zip"))
+
+    # --- WRITES ---
+
+    def record(self, artifact: Artifact, body: Iterator[bytes]) -> Iterator[bytes]:
+        """Pass a zip body through while writing it to the artifact's staging file."""
+        os.makedirs(self._shard(artifact.key), exist_ok=True)
+        staging = artifact.path + ".part"
+        sink: Optional[BinaryIO] = open(staging, "wb")
+        completed = False
+        try:
+            for chunk in body:
+                sink.write(chunk)
+                yield chunk
+            completed = True
+        except GeneratorExit:
+            # The client left mid-download; finish the build so its resume finds it
+            with self._lock:
+                adopt = self._finishing < self.max_finishing
+                self._finishing += adopt
+            if adopt:
+                future = self._finisher.submit(self._finish, artifact, body, sink, staging)
+                future.add_done_callback(self._report)
+                sink = None
+            raise
+        finally:
+            if sink is not None:
+                sink.close()
+                if completed:
+                    self._commit(artifact, staging)
+                else:
+                    self._discard(staging)
+
+    def _finish(self, artifact: Artifact, body: Iterator[bytes], sink: BinaryIO, staging: str):
+        try:
+            with sink:
+                for chunk in body:
+                    sink.write(chunk)
+        except BaseException:
+            self._discard(staging)
+            raise
+        finally:
+            with self._lock:
+                self._finishing -= 1
+        self._commit(artifact, staging)
+        with self._lock:
+            self.finished_abandoned += 1
+
+    def _commit(self, artifact: Artifact, staging: str):
+        if self._find(artifact.key) is not None:
+            # Another build of the same key landed first; its ETag is already out there
+            self._discard(staging)
+            return
+        # Metadata lands first, so a build that can be found always has it
+        with open(artifact.meta_path, "w", encoding="utf-8") as f:
+            json.dump(artifact.meta, f)
+        os.replace(staging, artifact.path)
+        with self._lock:
+            self.stored += 1
+            prune = self.stored % PRUNE_EVERY == 0
+        if prune:
+            self._prune()
+
+    def _discard(self, staging: str):
+        with self._lock:
+            self.discarded += 1
+        try:
+            os.remove(staging)
+        except OSError:
+            pass
+
+    def _prune(self):
+        files = []
+        total = 0
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if not name.endswith(".zip"):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        removed = 0
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            try:
+                os.remove(path[:-len(".zip")] + ".json")
+            except OSError:
+                pass
+            total -= size
+            removed += 1
+        log_event("artifacts_pruned", removed=removed, bytes=total)
+
+    @staticmethod
+    def _report(future):
+        error = future.exception()
+        if error is not None:
+            log_event("artifact_error", error=str(error))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stored": self.stored,
+                "finished_abandoned": self.finished_abandoned,
+                "discarded": self.discarded,
+            }
+
+    def shutdown(self):
+        self._finisher.shutdown(wait=True)
@@ -0,0 +1,3 @@
+# THE PROVING GROUND: refinery benchmarks.
+# Run from backend/:  python -m bench --help
+#                     python -m bench.load --help  (concurrent-load harness)
@@ -0,0 +1,143 @@
+import argparse
+import io
+import json
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+import main
+from ingest import SNIFF_BYTES, iter_export, sniff_format
+from zipstream import PROFILES, stream_zip
+from bench.synth import export_bytes
+
+# THE PROVING GROUND
+# Times every stage of the refinery on synthetic exports so regressions show
+# up before production does:
+#
+#   parse    ingest (UTF-8 scrub + ijson) of the raw export bytes
+#   detect   format sniffing from the first SNIFF_BYTES of each file
+#   extract  brand handler extraction into LogRefiner
+#   render   LogRefiner rendering to output chunks
+#   zip/N    streaming zip of the rendered entries on N deflate threads
+#   sse      JSON serialization of the `welded` SSE events
+#
+# python -m bench --brand all --conversations 500 --messages 40
+
+BRANDS = ("chatgpt", "claude", "gemini")
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def timed(fn: Callable[[], Any], repeat: int) -> Tuple[float, Any]:
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def run_brand(brand: str, args: argparse.Namespace) -> List[Dict[str, Any]]:
+    files = export_bytes(brand, args.conversations, args.messages, args.words, args.seed)
+    size_mb = sum(len(f) for f in files) / (1024 * 1024)
+    options = main.RefineryOptions(include_thoughts=True)
+
+    def parse():
+        return [pair for idx, raw in enumerate(files) for pair in iter_export(io.BytesIO(raw), f"{brand}_{idx}.json")]
+
+    def detect():
+        return [sniff_format(raw[:SNIFF_BYTES].lstrip(), len(raw) <= SNIFF_BYTES) for raw in files]
+
+    def extract():
+        return [main.BRAND_EXTRACTORS[name](item, options) for name, item in conversations]
+
+    def render():
+        return [(f"chat_{idx}.md", list(refiner.iter_refined_chunks())) for idx, refiner in enumerate(refiners)]
+
+    def build_zip(executor, workers):
+        return sum(len(chunk) for chunk in stream_zip(rendered, args.zip_profile, executor, workers))
+
+    def sse():
+        total = 0
+        for idx, refiner in enumerate(refiners):
+            messages = refiner.get_refined_messages()
+            event = {"status": "welded", "index": idx + 1, "total": len(refiners), "name": f"chat_{idx}", "messages": messages, "msg_count": len(messages)}
+            total += len(f"data: {json.dumps(event)}\n\n")
+        return total
+
+    rows = []
+
+    def record(stage: str, seconds: float):
+        rows.append({
+            "brand": brand,
+            "stage": stage,
+            "seconds": round(seconds, 4),
+            "mb_per_s": round(size_mb / seconds, 2) if seconds else None,
+            "conv_per_s": round(args.conversations / seconds, 1) if seconds else None,
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "input_mb": round(size_mb, 2),
+        })
+
+    seconds, conversations = timed(parse, args.repeat)
+    record("parse", seconds)
+    seconds, _ = timed(detect, args.repeat)
+    record("detect", seconds)
+    seconds, refiners = timed(extract, args.repeat)
+    record("extract", seconds)
+    seconds, rendered = timed(render, args.repeat)
+    record("render", seconds)
+    for workers in args.zip_workers:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="deflate") as executor:
+            seconds, _ = timed(lambda: build_zip(executor, workers), args.repeat)
+        record(f"zip/{workers}", seconds)
+    seconds, _ = timed(sse, args.repeat)
+    record("sse", seconds)
+    return rows
+
+
+def print_table(rows: List[Dict[str, Any]]):
+    header = f"{'BRAND':<8} {'STAGE':<8} {'SECONDS':>9} {'MB/S':>9} {'CONV/S':>10} {'PEAK_RSS_MB':>12}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(
+            f"{row['brand']:<8} {row['stage']:<8} {row['seconds']:>9.4f} "
+            f"{row['mb_per_s'] or 0:>9.2f} {row['conv_per_s'] or 0:>10.1f} {row['peak_rss_mb']:>12.1f}"
+        )
+
+
+def main_cli(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Benchmark the refinery stages on synthetic exports.")
+    parser.add_argument("--brand", choices=BRANDS + ("all",), default="all")
+    parser.add_argument("--conversations", type=int, default=200, help="conversations per brand")
+    parser.add_argument("--messages", type=int, default=40, help="turns per conversation")
+    parser.add_argument("--words", type=int, default=60, help="mean words per message")
+    parser.add_argument("--repeat", type=int, default=1, help="best-of-N timing per stage")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--zip-profile", choices=tuple(PROFILES), default="balanced")
+    parser.add_argument(
+        "--zip-workers", type=lambda v: [int(n) for n in v.split(",")], default=[os.cpu_count() or 1],
+        help="deflate thread counts to time, e.g. 1,2,4,8",
+    )
+    parser.add_argument("--json", dest="json_path", help="also write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    rows: List[Dict[str, Any]] = []
+    for brand in (BRANDS if args.brand == "all" else (args.brand,)):
+        rows.extend(run_brand(brand, args))
+
+    print_table(rows)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": rows}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,417 @@
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import random
+import resource
+import secrets
+import socket
+import sys
+import threading
+import time
+import types
+import uuid
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from bench.synth import export_bytes
+
+# THE STAMPEDE: CONCURRENT LOAD HARNESS
+# N simulated uploaders hit a live server (started in-process, or any URL) over
+# plain HTTP, the way browsers do:
+#
+#   stream      upload, consume /refine-stream to the end, then page through
+#               the next start_index batches on the session
+#   disconnect  upload and drop the SSE connection after a few events
+#   zip         upload and download the /refine zip
+#
+# A poller scrapes /metrics for event-loop lag and samples the server's
+# process-tree RSS. Reported: p50/p99 time-to-first-event, per-event gaps,
+# loop lag, throughput and peak RSS.
+#
+# In-process runs share a GIL (and RSS) with the client threads; use --url
+# against a separate server for numbers to size production workers with.
+#
+# python -m bench.load --users 50 --personality SIPHON --conversations 200
+# python -m bench.load --users 200 --personality TOLL --toll-scale 0.01
+# python -m bench.load --url http://127.0.0.1:8000 --pid 1234 --users 20
+
+KINDS = ("stream", "disconnect", "zip")
+POLL_SECONDS = 0.5
+
+
+# --- SERVER ---
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def scale_toll(main_module: types.ModuleType, scale: float):
+    """Shrink TOLL waits in-process: main sees an asyncio whose sleep is scaled, nothing else is."""
+    real = asyncio
+
+    class ScaledAsyncio(types.ModuleType):
+        def __getattr__(self, name):
+            return getattr(real, name)
+
+    shim = ScaledAsyncio("asyncio")
+    shim.sleep = lambda delay, *args, **kwargs: real.sleep(delay * scale, *args, **kwargs)
+    main_module.asyncio = shim
+
+
+def serve_inprocess(args: argparse.Namespace) -> Tuple[str, Any]:
+    # main reads its configuration at import time
+    os.environ["SITE_PERSONALITY"] = args.personality
+    os.environ.setdefault("METRICS_TOKEN", secrets.token_hex(16))
+    import uvicorn
+    import main
+    from metrics import LOGGER
+
+    if not args.server_logs:
+        LOGGER.setLevel("WARNING")
+    if args.toll_scale != 1:
+        scale_toll(main, args.toll_scale)
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning", lifespan="on"))
+    thread = threading.Thread(target=server.run, name="uvicorn", daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("in-process server failed to start")
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}", server
+
+
+# --- CLIENT ---
+
+def multipart(fields: Dict[str, str], files: List[Tuple[str, bytes]]) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for filename, data in files:
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="files"; filename="{filename}"\r\n'
+            f"Content-Type: application/json\r\n\r\n".encode() + data + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def iter_sse(response: http.client.HTTPResponse) -> Iterator[Dict[str, Any]]:
+    """Decoded `data:` payloads; id lines and keepalive comments are skipped."""
+    data: List[bytes] = []
+    while True:
+        line = response.readline()
+        if not line:
+            return
+        line = line.rstrip(b"\r\n")
+        if not line:
+            if data:
+                yield json.loads(b"\n".join(data))
+                data = []
+        elif line.startswith(b"data: "):
+            data.append(line[6:])
+
+
+class Client:
+    def __init__(self, base_url: str, timeout: float):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.timeout = timeout
+
+    def post(self, path: str, fields: Dict[str, str], files: List[Tuple[str, bytes]]) -> Tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        body, content_type = multipart(fields, files)
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        conn.request("POST", path, body=body, headers={"Content-Type": content_type})
+        return conn, conn.getresponse()
+
+    def get(self, path: str) -> bytes:
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        # /metrics is token-gated; the in-process server gets a fresh token, --url uses $METRICS_TOKEN
+        token = os.getenv("METRICS_TOKEN")
+        try:
+            conn.request("GET", path, headers={"Authorization": f"Bearer {token}"} if token else {})
+            return conn.getresponse().read()
+        finally:
+            conn.close()
+
+
+def run_stream(client: Client, upload: Tuple[str, bytes], args: argparse.Namespace, kind: str, rng: random.Random) -> Dict[str, Any]:
+    result: Dict[str, Any] = {"kind": kind, "ttfe": [], "gaps": [], "events": 0, "conversations": 0, "batches": 0, "bytes_up": 0, "error": None}
+    session_id: Optional[str] = None
+    start_index = 0
+    drop_after = rng.randint(1, max(1, args.drop_after)) if kind == "disconnect" else None
+    while result["batches"] < (1 if kind == "disconnect" else args.pages):
+        fields = {"options_json": json.dumps({"message_chunks": args.chunks}), "start_index": str(start_index)}
+        files = []
+        if session_id:
+            fields["session_id"] = session_id
+        else:
+            files = [upload]
+            result["bytes_up"] += len(upload[1])
+        started = time.perf_counter()
+        conn, response = client.post("/refine-stream", fields, files)
+        try:
+            if response.status != 200:
+                result["error"] = f"HTTP {response.status}"
+                return result
+            last = None
+            following = None
+            for event in iter_sse(response):
+                now = time.perf_counter()
+                if last is None:
+                    result["ttfe"].append(now - started)
+                else:
+                    result["gaps"].append(now - last)
+                last = now
+                result["events"] += 1
+                status = event.get("status")
+                if status == "start":
+                    session_id = event.get("session_id") or session_id
+                    following = event.get("next_index")
+                    # A parsed session says how many chats it holds; the last batch ends there
+                    if event.get("available") is not None and following is not None and following >= event["available"]:
+                        following = None
+                elif status == "welded":
+                    result["conversations"] += 1
+                elif status == "error":
+                    # Paging an uncached upload only finds its end by asking past it
+                    if event.get("message") != "BATCH_EMPTY":
+                        result["error"] = event.get("message")
+                    return result
+                if drop_after is not None and result["events"] >= drop_after:
+                    break
+        finally:
+            conn.close()
+        result["batches"] += 1
+        # Page from where the server says this batch ended (an uncached upload is re-sent)
+        if not following or following <= start_index:
+            break
+        start_index = following
+    return result
+
+
+def run_zip(client: Client, upload: Tuple[str, bytes], args: argparse.Namespace) -> Dict[str, Any]:
+    result: Dict[str, Any] = {"kind": "zip", "ttfe": [], "gaps": [], "events": 0, "conversations": 0, "batches": 1, "bytes_up": len(upload[1]), "bytes_down": 0, "error": None}
+    started = time.perf_counter()
+    conn, response = client.post("/refine", {"options_json": "{}", "start_index": "0"}, [upload])
+    try:
+        if response.status != 200:
+            result["error"] = f"HTTP {response.status}"
+            return result
+        last = None
+        while True:
+            chunk = response.read1(64 * 1024)
+            if not chunk:
+                break
+            now = time.perf_counter()
+            if last is None:
+                result["ttfe"].append(now - started)
+            else:
+                result["gaps"].append(now - last)
+            last = now
+            result["bytes_down"] += len(chunk)
+    finally:
+        conn.close()
+    return result
+
+
+def simulate_user(index: int, client: Client, upload: Tuple[str, bytes], args: argparse.Namespace, results: List[Dict[str, Any]]):
+    rng = random.Random(args.seed * 1000 + index)
+    time.sleep(args.ramp * index / max(1, args.users))
+    roll = rng.random()
+    kind = "disconnect" if roll < args.disconnect_rate else "zip" if roll < args.disconnect_rate + args.zip_rate else "stream"
+    started = time.perf_counter()
+    try:
+        result = run_zip(client, upload, args) if kind == "zip" else run_stream(client, upload, args, kind, rng)
+    except Exception as e:
+        result = {"kind": kind, "ttfe": [], "gaps": [], "events": 0, "conversations": 0, "batches": 0, "bytes_up": 0, "error": repr(e)}
+    result["seconds"] = time.perf_counter() - started
+    results.append(result)
+
+
+# --- SERVER-SIDE SAMPLING ---
+
+def tree_rss_mb(pid: int) -> float:
+    """Resident memory of a process and all of its descendants (the refinery pool workers)."""
+    total_kb = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                total_kb += next((int(line.split()[1]) for line in f if line.startswith("VmRSS:")), 0)
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pending.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return total_kb / 1024
+
+
+def parse_gauge(text: str, name: str) -> Optional[float]:
+    for line in text.splitlines():
+        if line.startswith(name + " "):
+            return float(line.split()[1])
+    return None
+
+
+class Poller(threading.Thread):
+    """Samples loop lag (from /metrics) and process-tree RSS until stopped."""
+
+    def __init__(self, client: Client, pid: Optional[int]):
+        super().__init__(name="load-poller", daemon=True)
+        self.client = client
+        self.pid = pid
+        self.lag: List[float] = []
+        self.rss: List[float] = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(POLL_SECONDS):
+            try:
+                lag = parse_gauge(self.client.get("/metrics").decode(), "washhouse_event_loop_lag_last_seconds")
+            except OSError:
+                lag = None
+            if lag is not None:
+                self.lag.append(lag)
+            if self.pid is not None:
+                self.rss.append(tree_rss_mb(self.pid))
+
+
+# --- REPORT ---
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def ms(value: Optional[float]) -> str:
+    return f"{value * 1000:9.1f}" if value is not None else f"{'-':>9}"
+
+
+def summarize(results: List[Dict[str, Any]], poller: Poller, elapsed: float, args: argparse.Namespace) -> Dict[str, Any]:
+    rows = []
+    for kind in KINDS:
+        group = [r for r in results if r["kind"] == kind]
+        if not group:
+            continue
+        ttfe = [t for r in group for t in r["ttfe"]]
+        gaps = [g for r in group for g in r["gaps"]]
+        rows.append({
+            "kind": kind,
+            "users": len(group),
+            "errors": sum(1 for r in group if r["error"]),
+            "batches": sum(r["batches"] for r in group),
+            "events": sum(r["events"] for r in group),
+            "conversations": sum(r["conversations"] for r in group),
+            "ttfe_p50": percentile(ttfe, 50),
+            "ttfe_p99": percentile(ttfe, 99),
+            "gap_p50": percentile(gaps, 50),
+            "gap_p99": percentile(gaps, 99),
+        })
+    bytes_up = sum(r["bytes_up"] for r in results)
+    return {
+        "rows": rows,
+        "seconds": round(elapsed, 3),
+        "upload_mb_per_s": round(bytes_up / (1024 * 1024) / elapsed, 2) if elapsed else None,
+        "conv_per_s": round(sum(r["conversations"] for r in results) / elapsed, 1) if elapsed else None,
+        "loop_lag_p50": percentile(poller.lag, 50),
+        "loop_lag_p99": percentile(poller.lag, 99),
+        "loop_lag_max": max(poller.lag) if poller.lag else None,
+        "peak_rss_mb": round(max(poller.rss), 1) if poller.rss else None,
+        "client_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "errors": [r["error"] for r in results if r["error"]][:10],
+    }
+
+
+def print_report(summary: Dict[str, Any]):
+    header = f"{'KIND':<10} {'USERS':>6} {'ERR':>5} {'BATCHES':>8} {'EVENTS':>8} {'TTFE_P50':>9} {'TTFE_P99':>9} {'GAP_P50':>9} {'GAP_P99':>9}"
+    print(header + "   (ms)")
+    print("-" * len(header))
+    for row in summary["rows"]:
+        print(
+            f"{row['kind']:<10} {row['users']:>6} {row['errors']:>5} {row['batches']:>8} {row['events']:>8} "
+            f"{ms(row['ttfe_p50'])} {ms(row['ttfe_p99'])} {ms(row['gap_p50'])} {ms(row['gap_p99'])}"
+        )
+    print()
+    print(f"wall           {summary['seconds']:.2f}s")
+    print(f"throughput     {summary['upload_mb_per_s'] or 0:.2f} MB/s uploaded, {summary['conv_per_s'] or 0:.1f} chats/s welded")
+    print(f"loop lag (ms)  p50 {ms(summary['loop_lag_p50']).strip()}  p99 {ms(summary['loop_lag_p99']).strip()}  max {ms(summary['loop_lag_max']).strip()}")
+    rss = f"{summary['peak_rss_mb']:.1f} MB" if summary["peak_rss_mb"] is not None else "n/a (pass --pid)"
+    print(f"peak RSS       server tree {rss}, client {summary['client_peak_rss_mb']:.1f} MB")
+    for error in summary["errors"]:
+        print(f"error          {error}")
+
+
+def main_cli(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench.load", description="Simulate concurrent uploaders against the refinery.")
+    parser.add_argument("--url", help="target a running server instead of starting one in-process")
+    parser.add_argument("--pid", type=int, help="server PID for RSS sampling with --url")
+    parser.add_argument("--personality", choices=("TOLL", "SIPHON"), default="SIPHON", help="in-process server personality")
+    parser.add_argument("--toll-scale", type=float, default=1.0, help="in-process only: multiply TOLL waits (e.g. 0.01)")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--ramp", type=float, default=2.0, help="seconds over which users start")
+    parser.add_argument("--brand", choices=("chatgpt", "claude"), default="chatgpt")
+    parser.add_argument("--conversations", type=int, default=60, help="conversations per upload")
+    parser.add_argument("--messages", type=int, default=30, help="turns per conversation")
+    parser.add_argument("--words", type=int, default=60, help="mean words per message")
+    parser.add_argument("--shared-upload", action="store_true", help="every user uploads the same bytes (session cache hits)")
+    parser.add_argument("--pages", type=int, default=3, help="stream users page through up to this many batches")
+    parser.add_argument("--disconnect-rate", type=float, default=0.2)
+    parser.add_argument("--drop-after", type=int, default=5, help="disconnecting users leave after 1..N events")
+    parser.add_argument("--zip-rate", type=float, default=0.2)
+    parser.add_argument("--chunks", action="store_true", help="request message_chunks SSE framing")
+    parser.add_argument("--timeout", type=float, default=900.0)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--server-logs", action="store_true", help="keep the in-process server's JSON event log")
+    parser.add_argument("--json", dest="json_path", help="also write results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    server = None
+    if args.url:
+        base_url, pid = args.url.rstrip("/"), args.pid
+    else:
+        base_url, server = serve_inprocess(args)
+        pid = os.getpid()
+
+    variants = 1 if args.shared_upload else args.users
+    uploads = [
+        (f"load_{i}.json", export_bytes(args.brand, args.conversations, args.messages, args.words, args.seed + i)[0])
+        for i in range(variants)
+    ]
+    client = Client(base_url, args.timeout)
+    poller = Poller(client, pid)
+    poller.start()
+
+    results: List[Dict[str, Any]] = []
+    threads = [
+        threading.Thread(target=simulate_user, args=(i, client, uploads[i % variants], args, results), daemon=True)
+        for i in range(args.users)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    poller.stopped.set()
+    poller.join()
+    if server is not None:
+        server.should_exit = True
+
+    summary = summarize(results, poller, elapsed, args)
+    print_report(summary)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": summary}, f, indent=2)
+    return 1 if any(row["errors"] for row in summary["rows"]) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
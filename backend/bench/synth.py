@@ -0,0 +1,111 @@
+import json
+import random
+import uuid
+from typing import Any, Dict, List
+
+# SYNTHETIC EXPORTS
+# Shaped like the real ChatGPT / Claude / Gemini exports the refinery ingests,
+# deterministic per seed so runs are comparable.
+
+WORDS = (
+    "the refinery pulls verbatim logs out of raw exports strips machine noise "
+    "and welds every turn into a clean transcript def class return import async "
+    "await yield lambda function payload stream batch vault session token model "
+    "user prompt response thought chunk branch fork regenerate edit tree node"
+).split()
+
+EPOCH = 1_700_000_000.0
+
+
+def _text(rng: random.Random, words: int) -> str:
+    count = max(1, int(rng.gauss(words, words / 3)))
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+def _uid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128)))
+
+
+def chatgpt_conversation(rng: random.Random, index: int, messages: int, words: int, fork_rate: float = 0.1) -> Dict[str, Any]:
+    """A `mapping` tree: system root, alternating turns, and regeneration forks."""
+    root = _uid(rng)
+    mapping: Dict[str, Any] = {root: {"id": root, "message": None, "parent": None, "children": []}}
+    current = root
+    created = EPOCH + index * 3600
+    for turn in range(messages):
+        role = "user" if turn % 2 == 0 else "assistant"
+        siblings = 1 + (1 if rng.random() < fork_rate else 0)
+        for _ in range(siblings):
+            node_id = _uid(rng)
+            mapping[node_id] = {
+                "id": node_id,
+                "message": {
+                    "id": node_id,
+                    "author": {"role": role, "name": None, "metadata": {}},
+                    "create_time": created + turn,
+                    "content": {"content_type": "text", "parts": [_text(rng, words)]},
+                    "status": "finished_successfully",
+                    "metadata": {"model_slug": "gpt-4o"} if role == "assistant" else {},
+                },
+                "parent": current,
+                "children": [],
+            }
+            mapping[current]["children"].append(node_id)
+        # PLAY A: the last sibling is the surviving branch
+        current = mapping[current]["children"][-1]
+    return {
+        "title": f"Synthetic ChatGPT {index}",
+        "create_time": created,
+        "update_time": created + messages,
+        "mapping": mapping,
+        "current_node": current,
+        "id": _uid(rng),
+    }
+
+
+def claude_conversation(rng: random.Random, index: int, messages: int, words: int) -> Dict[str, Any]:
+    chat = []
+    for turn in range(messages):
+        blocks: List[Dict[str, Any]] = [{"type": "text", "text": _text(rng, words)}]
+        if turn % 2 and rng.random() < 0.2:
+            blocks.append({"type": "tool_use", "name": "artifacts", "input": {"content": _text(rng, words)}})
+        chat.append({
+            "uuid": _uid(rng),
+            "sender": "human" if turn % 2 == 0 else "assistant",
+            "text": "",
+            "content": blocks,
+            "created_at": "2024-01-01T00:00:00Z",
+        })
+    return {
+        "uuid": _uid(rng),
+        "name": f"Synthetic Claude {index}",
+        "created_at": "2024-01-01T00:00:00Z",
+        "updated_at": "2024-01-02T00:00:00Z",
+        "chat_messages": chat,
+    }
+
+
+def gemini_conversation(rng: random.Random, index: int, messages: int, words: int, chunks_per_reply: int = 4) -> Dict[str, Any]:
+    """AI Studio `chunkedPrompt`: model replies arrive as runs of chunks, some of them thoughts."""
+    chunks: List[Dict[str, Any]] = []
+    for turn in range(messages):
+        if turn % 2 == 0:
+            chunks.append({"role": "user", "text": _text(rng, words)})
+            continue
+        chunks.append({"role": "model", "text": "", "isThought": True, "parts": [{"text": _text(rng, words // 2), "thought": True}]})
+        for _ in range(chunks_per_reply):
+            chunks.append({"role": "model", "text": _text(rng, max(1, words // chunks_per_reply))})
+    return {
+        "title": f"Synthetic Gemini {index}",
+        "runSettings": {"model": "models/gemini-2.5-pro", "temperature": 1},
+        "chunkedPrompt": {"chunks": chunks},
+    }
+
+
+def export_bytes(brand: str, conversations: int, messages: int, words: int, seed: int = 7) -> List[bytes]:
+    """Serialized export files for a brand. ChatGPT/Claude: one array; Gemini: one file per chat."""
+    rng = random.Random(seed)
+    if brand == "gemini":
+        return [json.dumps(gemini_conversation(rng, i, messages, words)).encode() for i in range(conversations)]
+    build = chatgpt_conversation if brand == "chatgpt" else claude_conversation
+    return [json.dumps([build(rng, i, messages, words) for i in range(conversations)]).encode()]
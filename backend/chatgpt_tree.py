@@ -0,0 +1,85 @@
+from typing import Any, Dict, Iterator, List, Literal, Optional, Tuple, get_args
+
+# THE ROOT SYSTEM: CHATGPT MAPPING TRAVERSAL
+# ChatGPT stores a conversation as a node tree (see CHATGPT_PLAY_A_SPEC.md).
+# The index is built once per conversation and every strategy walks it
+# iteratively: O(nodes), no recursion limit on 10k+ node trees.
+#
+#   last_child    PLAY A. Root to leaf, always taking the newest child.
+#   current_node  The path the user was looking at on export (leaf -> root, reversed).
+#   all_branches  Every branch, depth first; shared prefixes are emitted once.
+#                 The first message of each sibling branch is flagged so the
+#                 refiner never fuses two regenerations into one message.
+
+BranchStrategy = Literal["last_child", "current_node", "all_branches"]
+BRANCH_STRATEGIES = get_args(BranchStrategy)
+
+
+class ConversationTree:
+    def __init__(self, mapping: Dict[str, Any], current_node: Optional[str] = None):
+        self.mapping = mapping or {}
+        self.current_node = current_node
+        self.root_id: Optional[str] = None
+        self.children: Dict[str, List[str]] = {}
+        for node_id, node in self.mapping.items():
+            if self.root_id is None and node.get("parent") is None:
+                self.root_id = node_id
+            # Drop dangling child references once, up front
+            self.children[node_id] = [c for c in node.get("children") or [] if c in self.mapping]
+
+    def last_child_path(self) -> Iterator[str]:
+        seen = set()
+        current_id = self.root_id
+        while current_id and current_id not in seen:
+            seen.add(current_id)
+            yield current_id
+            children = self.children.get(current_id)
+            current_id = children[-1] if children else None
+
+    def current_node_path(self) -> Iterator[str]:
+        if self.current_node not in self.mapping:
+            # Older exports carry no current_node: fall back to PLAY A
+            yield from self.last_child_path()
+            return
+        path = []
+        seen = set()
+        node_id = self.current_node
+        while node_id and node_id in self.mapping and node_id not in seen:
+            seen.add(node_id)
+            path.append(node_id)
+            node_id = self.mapping[node_id].get("parent")
+        yield from reversed(path)
+
+    def all_branches(self) -> Iterator[str]:
+        seen = set()
+        stack = [self.root_id] if self.root_id else []
+        while stack:
+            node_id = stack.pop()
+            if node_id in seen:
+                continue
+            seen.add(node_id)
+            yield node_id
+            # Reversed so the first child is visited first
+            stack.extend(reversed(self.children.get(node_id, [])))
+
+    def walk(self, strategy: str = "last_child") -> Iterator[str]:
+        if strategy == "current_node":
+            return self.current_node_path()
+        if strategy == "all_branches":
+            return self.all_branches()
+        return self.last_child_path()
+
+    def messages(self, strategy: str = "last_child") -> Iterator[Tuple[Dict[str, Any], bool]]:
+        """(message, starts_branch) along the chosen strategy, skipping structural nodes.
+
+        starts_branch is only ever set by all_branches: the walk just jumped
+        from the end of one sibling branch to the start of the next.
+        """
+        forks = {c for kids in self.children.values() for c in kids[1:]} if strategy == "all_branches" else set()
+        forked = False
+        for node_id in self.walk(strategy):
+            forked = forked or node_id in forks
+            message = self.mapping[node_id].get("message")
+            if message:
+                yield message, forked
+                forked = False
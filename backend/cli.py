@@ -0,0 +1,244 @@
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Tuple
+
+from pydantic import ValidationError
+
+import main
+from chatgpt_tree import BRANCH_STRATEGIES
+from executor import RefineExecutor
+from ingest import iter_export
+from metrics import LOGGER
+from zipstream import CHUNK_BYTES, PROFILES, stream_zip
+
+# THE NIGHT SHIFT: OFFLINE BULK REFINERY
+# Refines whole directories of exports without the HTTP layer: no multipart,
+# no 20-chat batches, no toll. Each export file is one job on a process pool;
+# workers parse and render with the same handlers as the API and write entries
+# straight into the output directory. For a .zip --out they write to a spool
+# directory next to it instead and hand back only the entry names; the parent
+# streams each file into the one output zip and deletes it. Entries land
+# under <export stem>/.
+#
+# python cli.py ~/exports --out refined/ --formats md,json
+# python cli.py "~/exports/**/*.zip" --out refined.zip --workers 8
+# python cli.py export.zip --out picked/ --title "kubernetes" --created-after 2024-01-01
+
+EXPORT_SUFFIXES = (".json", ".zip")
+
+
+def find_exports(patterns: List[str]) -> List[str]:
+    """Expand directories (recursively, .json and .zip) and globs into a sorted, de-duplicated list."""
+    found: Dict[str, None] = {}
+    for pattern in patterns:
+        pattern = os.path.expanduser(pattern)
+        if os.path.isdir(pattern):
+            for directory, _, names in os.walk(pattern):
+                for name in sorted(names):
+                    if name.lower().endswith(EXPORT_SUFFIXES) and not name.startswith("."):
+                        found[os.path.join(directory, name)] = None
+        else:
+            for path in sorted(glob.glob(pattern, recursive=True)) or ([pattern] if os.path.isfile(pattern) else []):
+                if os.path.isfile(path):
+                    found[path] = None
+    return list(found)
+
+
+def export_stem(path: str, taken: Dict[str, int]) -> str:
+    """Output folder for one export; same-named exports from different directories get a suffix."""
+    stem = main.entry_name(os.path.splitext(os.path.basename(path))[0]) or "export"
+    count = taken.get(stem, 0)
+    taken[stem] = count + 1
+    return stem if count == 0 else f"{stem}.{count + 1}"
+
+
+def unique_name(name: str, taken: Dict[str, int]) -> str:
+    # Titles repeat inside an export ("New chat"); later ones get .2, .3, ...
+    count = taken.get(name, 0)
+    taken[name] = count + 1
+    if count == 0:
+        return name
+    base, ext = os.path.splitext(name)
+    return f"{base}.{count + 1}{ext}"
+
+
+def refine_export(path: str, stem: str, options: main.RefineryOptions, out_dir: str) -> Tuple[Dict[str, Any], List[str]]:
+    """Worker entry point: parse and render one export file into out_dir.
+
+    Returns stats and the written entry names (relative to out_dir), never
+    the rendered text, so nothing big is pickled back to the parent.
+    """
+    stats: Dict[str, Any] = {"path": path, "bytes": os.path.getsize(path), "conversations": 0, "messages": 0, "error": None}
+    written: List[str] = []
+    taken: Dict[str, int] = {}
+    started = time.perf_counter()
+    try:
+        with open(path, "rb") as raw:
+            for position, (brand, item) in enumerate(iter_export(raw, os.path.basename(path), options.conversation_filter()), 1):
+                refiner = main.BRAND_EXTRACTORS[brand](item, options)
+                title = main.display_name(brand, item, position)
+                name = main.entry_name(title)
+                for fmt in options.formats():
+                    entry = f"{stem}/{unique_name(f'{name}.{fmt}', taken)}"
+                    target = os.path.join(out_dir, entry)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    with open(target, "w", encoding="utf-8") as f:
+                        f.writelines(main.RENDERERS[fmt](refiner, title))
+                    written.append(entry)
+                stats["conversations"] += 1
+                stats["messages"] += sum(1 for _ in refiner.visible())
+    except Exception as e:
+        stats["error"] = str(e)
+    stats["seconds"] = round(time.perf_counter() - started, 4)
+    return stats, written
+
+
+def spooled(path: str) -> Iterator[bytes]:
+    """A spooled entry's bytes in zip-slice pieces; the file is removed once read."""
+    try:
+        with open(path, "rb") as f:
+            while True:
+                piece = f.read(CHUNK_BYTES)
+                if not piece:
+                    break
+                yield piece
+    finally:
+        os.remove(path)
+
+
+def report_progress(done: int, total: int, stats: Dict[str, Any]):
+    status = f"FAILED: {stats['error']}" if stats["error"] else (
+        f"{stats['conversations']} chats" if stats["conversations"] else "NO_VALID_PAYLOAD"
+    )
+    print(
+        f"[{done:>{len(str(total))}}/{total}] {stats['path']}  {stats['bytes'] / (1024 * 1024):.2f} MB  "
+        f"{stats['seconds']:.2f}s  {status}",
+        file=sys.stderr,
+    )
+
+
+def main_cli(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python cli.py", description="Refine directories of AI chat exports offline.")
+    parser.add_argument("inputs", nargs="+", help="export files, directories (searched recursively) or globs")
+    parser.add_argument("--out", required=True, help="output directory, or a path ending in .zip")
+    parser.add_argument("--formats", default="md", help="comma-separated: md, txt, json, html")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="process pool size (0 runs inline)")
+    parser.add_argument("--include-thoughts", action="store_true")
+    parser.add_argument("--no-user", action="store_true", help="drop user messages")
+    parser.add_argument("--no-bot", action="store_true", help="drop assistant messages")
+    parser.add_argument("--zip-profile", default="balanced", choices=tuple(PROFILES), help="compression for a .zip --out")
+    parser.add_argument("--branch-strategy", default="last_child", choices=BRANCH_STRATEGIES)
+    parser.add_argument("--json", dest="json_path", help="also write the run summary as JSON to this path")
+    picking = parser.add_argument_group("filter", "refine only matching conversations (times: epoch seconds or ISO 8601)")
+    picking.add_argument("--title", help="case-insensitive regex searched in the title")
+    picking.add_argument("--created-after")
+    picking.add_argument("--created-before")
+    picking.add_argument("--updated-after")
+    picking.add_argument("--updated-before")
+    picking.add_argument("--id", dest="ids", action="append", default=[], help="conversation id (repeatable)")
+    picking.add_argument("--min-messages", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    # The summary owns stdout; progress lines and ingest events go to stderr
+    for handler in LOGGER.handlers:
+        handler.setStream(sys.stderr)
+
+    paths = find_exports(args.inputs)
+    if not paths:
+        print("no export files found", file=sys.stderr)
+        return 1
+    try:
+        picked = main.ConversationQuery(
+            title=args.title,
+            created_after=args.created_after,
+            created_before=args.created_before,
+            updated_after=args.updated_after,
+            updated_before=args.updated_before,
+            ids=args.ids,
+            min_messages=args.min_messages,
+        )
+    except ValidationError as e:
+        print(f"bad filter: {'; '.join(err['msg'] for err in e.errors())}", file=sys.stderr)
+        return 2
+    options = main.RefineryOptions(
+        include_user=not args.no_user,
+        include_bot=not args.no_bot,
+        include_thoughts=args.include_thoughts,
+        output_formats=[fmt for fmt in args.formats.split(",") if fmt.strip()],
+        branch_strategy=args.branch_strategy,
+        filter=picked,
+    )
+    to_zip = args.out.lower().endswith(".zip")
+    if to_zip:
+        if os.path.dirname(args.out):
+            os.makedirs(os.path.dirname(args.out), exist_ok=True)
+        # Rendered entries wait here (same filesystem as the zip) until appended
+        out_dir = tempfile.mkdtemp(prefix=os.path.basename(args.out) + ".", suffix=".spool", dir=os.path.dirname(args.out) or ".")
+    else:
+        out_dir = args.out
+        os.makedirs(out_dir, exist_ok=True)
+
+    stems: Dict[str, int] = {}
+    jobs = [(path, export_stem(path, stems), options, out_dir) for path in paths]
+    executor = RefineExecutor(args.workers, "process")
+    totals = {"files": len(paths), "failed": 0, "empty": 0, "conversations": 0, "messages": 0, "bytes": 0}
+    started = time.perf_counter()
+
+    def finished() -> Iterator[Tuple[str, Iterator[bytes]]]:
+        for done, (stats, entries) in enumerate(executor.map_ordered(refine_export, jobs), 1):
+            report_progress(done, len(paths), stats)
+            totals["failed"] += stats["error"] is not None
+            totals["empty"] += stats["error"] is None and not stats["conversations"]
+            totals["conversations"] += stats["conversations"]
+            totals["messages"] += stats["messages"]
+            totals["bytes"] += stats["bytes"]
+            for entry in entries:
+                yield entry, spooled(os.path.join(out_dir, entry))
+
+    try:
+        if to_zip:
+            staging = args.out + ".part"
+            # Deflate on threads alongside the refine processes
+            deflaters = os.cpu_count() or 1
+            with ThreadPoolExecutor(max_workers=deflaters, thread_name_prefix="deflate") as deflate, open(staging, "wb") as f:
+                for chunk in stream_zip(finished(), args.zip_profile, deflate, deflaters):
+                    f.write(chunk)
+            os.replace(staging, args.out)
+        else:
+            for _ in finished():
+                pass
+    finally:
+        executor.shutdown()
+        if to_zip:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+    elapsed = time.perf_counter() - started
+    summary = {
+        **totals,
+        "seconds": round(elapsed, 3),
+        "mb_per_s": round(totals["bytes"] / (1024 * 1024) / elapsed, 2) if elapsed else None,
+        "conv_per_s": round(totals["conversations"] / elapsed, 1) if elapsed else None,
+        "workers": args.workers,
+        "out": args.out,
+    }
+    print(
+        f"{summary['files']} files ({summary['failed']} failed, {summary['empty']} empty)  "
+        f"{summary['conversations']} chats  {summary['messages']} messages  "
+        f"{totals['bytes'] / (1024 * 1024):.1f} MB in {summary['seconds']:.2f}s  "
+        f"{summary['mb_per_s'] or 0:.2f} MB/s  {summary['conv_per_s'] or 0:.1f} chats/s  -> {args.out}"
+    )
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "summary": summary}, f, indent=2)
+    return 1 if totals["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
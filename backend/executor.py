@@ -0,0 +1,116 @@
+import asyncio
+import os
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Deque, Iterable, Iterator, Optional, Tuple
+
+# THE FURNACE: PARALLEL REFINEMENT
+# Brand handlers are pure CPU work. Running them inline inside the async
+# endpoints stalls the event loop for every other client, so conversations are
+# fanned out across a worker pool. Results always come back in input order.
+
+
+def _timed_call(fn: Callable, *args) -> Tuple[float, Any]:
+    # Runs inside the worker, so the duration excludes queueing and pickling
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+class RefineExecutor:
+    """Order-preserving fan-out over a process (default) or thread pool.
+
+    workers <= 0 runs everything inline on the caller, which is handy when
+    debugging a handler.
+    """
+
+    def __init__(self, workers: int, kind: str = "process", observe: Optional[Callable[[float], None]] = None):
+        self.workers = workers
+        # Optional per-job duration callback (fed to the stage histogram)
+        self.observe = observe
+        self.kind = kind if kind in ("process", "thread") else "process"
+        # Enough in flight to keep every worker busy while the head is consumed
+        self.window = max(1, workers * 2)
+        self._pool: Optional[Executor] = None
+
+    @property
+    def pool(self) -> Optional[Executor]:
+        if self._pool is None and self.workers > 0:
+            if self.kind == "thread":
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="refinery")
+            else:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def submit(self, fn: Callable, *args) -> Future:
+        if self.observe is not None:
+            args = (fn,) + args
+            fn = _timed_call
+        pool = self.pool
+        if pool is not None:
+            return pool.submit(fn, *args)
+        future: Future = Future()
+        try:
+            future.set_result(fn(*args))
+        except BaseException as exc:
+            future.set_exception(exc)
+        return future
+
+    def resolved(self, value: Any) -> Future:
+        """An already-finished job (e.g. a cache hit) that can be queued alongside real ones."""
+        future: Future = Future()
+        future.set_result((None, value) if self.observe is not None else value)
+        return future
+
+    def _unwrap(self, outcome: Any) -> Any:
+        if self.observe is None:
+            return outcome
+        seconds, result = outcome
+        if seconds is not None:
+            self.observe(seconds)
+        return result
+
+    def _queue(self, fn: Callable, job: Any) -> Future:
+        return job if isinstance(job, Future) else self.submit(fn, *job)
+
+    def map_ordered(self, fn: Callable, jobs: Iterable[Any]) -> Iterator[Any]:
+        """Blocking, ordered map for sync consumers (e.g. a streaming zip body).
+
+        A job is an args tuple for fn, or a Future from resolved().
+        """
+        pending: Deque[Future] = deque()
+        try:
+            for job in jobs:
+                pending.append(self._queue(fn, job))
+                if len(pending) >= self.window:
+                    yield self._unwrap(pending.popleft().result())
+            while pending:
+                yield self._unwrap(pending.popleft().result())
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def amap_ordered(self, fn: Callable, jobs: Iterable[Any]) -> AsyncIterator[Any]:
+        """Ordered map for async consumers; the event loop stays free while workers run."""
+        pending: Deque[asyncio.Future] = deque()
+        try:
+            for job in jobs:
+                pending.append(asyncio.wrap_future(self._queue(fn, job)))
+                if len(pending) >= self.window:
+                    yield self._unwrap(await pending.popleft())
+            while pending:
+                yield self._unwrap(await pending.popleft())
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+def executor_from_env(observe: Optional[Callable[[float], None]] = None) -> RefineExecutor:
+    workers = int(os.getenv("REFINERY_WORKERS", str(os.cpu_count() or 1)))
+    return RefineExecutor(workers, os.getenv("REFINERY_POOL", "process").lower(), observe)
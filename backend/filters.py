@@ -0,0 +1,170 @@
+import re
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple, Union
+
+from chatgpt_tree import ConversationTree
+
+# THE SORTING TABLE: CONVERSATION FILTERS
+# Picks conversations by their metadata (title regex, create/update time
+# range, id list) and a minimum message count. Ingest applies the filter to
+# each conversation the moment the parser hands it over, so the ones that
+# miss are never held in a session, batched, refined or archived.
+#
+# The metadata is checked first; the message count (the only criterion that
+# walks the payload) only runs on conversations that already passed it. It
+# counts what the refinery would emit: user and assistant turns with text, on
+# the request's branch strategy, with consecutive same-role messages merged
+# and thoughts left out. System, tool, hidden and empty nodes never count.
+
+# Where each brand keeps the fields the filter reads
+FIELDS: Dict[str, Dict[str, Tuple[str, ...]]] = {
+    "ChatGPT": {"title": ("title",), "created": ("create_time",), "updated": ("update_time",), "id": ("id", "conversation_id")},
+    "Claude": {"title": ("name",), "created": ("created_at",), "updated": ("updated_at",), "id": ("uuid",)},
+    "Gemini": {"title": ("title",), "created": (), "updated": (), "id": ()},
+}
+
+Instant = Union[int, float, str]
+
+
+def to_epoch(value: Any) -> Optional[float]:
+    """Epoch seconds from a number or an ISO 8601 date/datetime (naive means UTC); None if unreadable."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str) and value:
+        try:
+            moment = datetime.fromisoformat(value.strip())
+        except ValueError:
+            return None
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        return moment.timestamp()
+    return None
+
+
+Turn = Tuple[str, str, bool, bool]  # (role, text, is_thought, starts a new turn)
+
+
+def _chatgpt_turns(conv: Dict[str, Any], strategy: str) -> Iterator[Turn]:
+    tree = ConversationTree(conv.get("mapping") or {}, conv.get("current_node"))
+    branch_start = False
+    for message, forked in tree.messages(strategy):
+        branch_start = branch_start or forked
+        role = (message.get("author") or {}).get("role")
+        text = "".join(p for p in (message.get("content") or {}).get("parts") or [] if isinstance(p, str))
+        if role in ("user", "assistant") and text.strip():
+            yield "user" if role == "user" else "model", text, False, branch_start
+            branch_start = False
+
+
+def _claude_turns(chat: Dict[str, Any], strategy: str) -> Iterator[Turn]:
+    for message in chat.get("chat_messages") or []:
+        blocks = message.get("content") or []
+        text = "".join(b.get("text", "") for b in blocks if isinstance(b, dict) and b.get("type") == "text")
+        yield "user" if message.get("sender") == "human" else "model", text, False, False
+
+
+def _gemini_turns(data: Dict[str, Any], strategy: str) -> Iterator[Turn]:
+    for chunk in (data.get("chunkedPrompt") or {}).get("chunks") or []:
+        role = chunk.get("role")
+        if role not in ("user", "model"):
+            continue
+        parts = [p for p in chunk.get("parts") or [] if isinstance(p, dict)]
+        text = (chunk.get("text") or "") + "".join(p.get("text", "") for p in parts)
+        yield role, text, bool(chunk.get("isThought") or any(p.get("thought") for p in parts)), False
+
+
+# Mirrors the brand extractors in main.py, minus the text they keep
+TURN_READERS = {
+    "ChatGPT": _chatgpt_turns,
+    "Claude": _claude_turns,
+    "Gemini": _gemini_turns,
+}
+
+
+def count_messages(brand: str, conv: Dict[str, Any], strategy: str = "last_child") -> int:
+    """Messages the refinery would emit for conv (thoughts excluded); 0 for an unknown brand."""
+    reader = TURN_READERS.get(brand)
+    if reader is None:
+        return 0
+    count, last = 0, None
+    for role, text, is_thought, new_turn in reader(conv, strategy):
+        if not text.strip():
+            continue
+        # The refiner merges consecutive text of one role into one message
+        if new_turn or (role, is_thought) != last:
+            count += not is_thought
+        last = (role, is_thought)
+    return count
+
+
+def _bound(value: Optional[Instant], name: str) -> Optional[float]:
+    if value is None:
+        return None
+    epoch = to_epoch(value)
+    if epoch is None:
+        raise ValueError(f"{name}: not an epoch or ISO 8601 time: {value!r}")
+    return epoch
+
+
+class ConversationFilter:
+    def __init__(
+        self,
+        title: Optional[str] = None,
+        created_after: Optional[Instant] = None,
+        created_before: Optional[Instant] = None,
+        updated_after: Optional[Instant] = None,
+        updated_before: Optional[Instant] = None,
+        ids: Iterable[str] = (),
+        min_messages: int = 0,
+        branch_strategy: str = "last_child",
+    ):
+        self.title = re.compile(title, re.IGNORECASE) if title else None
+        spans = {
+            "created": (_bound(created_after, "created_after"), _bound(created_before, "created_before")),
+            "updated": (_bound(updated_after, "updated_after"), _bound(updated_before, "updated_before")),
+        }
+        # field -> (after inclusive, before exclusive), epoch seconds; unbounded fields left out
+        self.ranges = {field: span for field, span in spans.items() if span != (None, None)}
+        self.ids = frozenset(str(i) for i in ids if i)
+        self.min_messages = max(0, int(min_messages or 0))
+        # Which ChatGPT path the message count walks (the same one the refiner renders)
+        self.branch_strategy = branch_strategy
+
+    @property
+    def active(self) -> bool:
+        return bool(self.title or self.ranges or self.ids or self.min_messages)
+
+    def scope(self) -> Dict[str, Any]:
+        """Canonical form, for keying sessions parsed through this filter."""
+        return {
+            "title": self.title.pattern if self.title else None,
+            "ranges": {field: list(span) for field, span in sorted(self.ranges.items())},
+            "ids": sorted(self.ids),
+            "min_messages": self.min_messages,
+            # Only changes the outcome when messages are counted
+            "branch_strategy": self.branch_strategy if self.min_messages else None,
+        }
+
+    def _check(self, field: str, value: Any) -> bool:
+        if field == "title":
+            return isinstance(value, str) and self.title.search(value) is not None
+        if field == "id":
+            return value is not None and str(value) in self.ids
+        moment = to_epoch(value)
+        after, before = self.ranges[field]
+        return moment is not None and (after is None or moment >= after) and (before is None or moment < before)
+
+    def matches(self, brand: str, conv: Dict[str, Any]) -> bool:
+        fields = FIELDS.get(brand)
+        if fields is None or not isinstance(conv, dict):
+            return False
+        wanted = [f for f, on in (("title", self.title), ("id", self.ids)) if on] + list(self.ranges)
+        for field in wanted:
+            # Any of a field's keys may carry it (ChatGPT has id and conversation_id)
+            if not any(self._check(field, conv[key]) for key in fields[field] if key in conv):
+                return False
+        if self.min_messages:
+            return count_messages(brand, conv, self.branch_strategy) >= self.min_messages
+        return True
@@ -0,0 +1,261 @@
+import codecs
+import io
+import mmap
+import os
+import tempfile
+import zipfile
+import zlib
+from itertools import chain
+from typing import Any, BinaryIO, Dict, Iterator, Optional, Tuple
+
+import ijson
+
+from filters import ConversationFilter
+from metrics import log_event
+
+# THE INTAKE: ITERATIVE INGEST
+# Exports are pulled off the upload one conversation at a time through ijson.
+# Peak memory tracks the largest single conversation, never the whole file.
+
+READ_CHUNK = 64 * 1024
+JSON_WHITESPACE = b" \t\r\n"
+
+
+def map_upload(raw: BinaryIO) -> Optional[mmap.mmap]:
+    """Read-only mapping of a disk-backed upload; None for in-memory or empty ones.
+
+    Uploads past the multipart spool threshold live in a temp file. Parsing,
+    hashing and archival read its pages in place instead of copying the
+    whole export onto the heap.
+    """
+    if isinstance(raw, tempfile.SpooledTemporaryFile) and not getattr(raw, "_rolled", True):
+        return None
+    try:
+        return mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+class ScrubbedReader:
+    """Byte reader that swaps invalid UTF-8 for U+FFFD (same as decode(errors='replace'))."""
+
+    def __init__(self, raw: BinaryIO, chunk_size: int = READ_CHUNK):
+        self.raw = raw
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.replaced = False
+        self.bytes_read = 0
+        self._pending = b""
+        self._eof = False
+
+    def _pull(self) -> bytes:
+        while not self._eof:
+            chunk = self.raw.read(self.chunk_size)
+            self.bytes_read += len(chunk)
+            self._eof = not chunk
+            text = self.decoder.decode(chunk, final=self._eof)
+            if text:
+                if "\ufffd" in text:
+                    self.replaced = True
+                return text.encode("utf-8")
+        return b""
+
+    def prefix(self, limit: int) -> Tuple[bytes, bool]:
+        """Buffer up to `limit` bytes, leading whitespace skipped, without consuming them.
+
+        Returns (prefix, complete); complete means the prefix is the whole document.
+        """
+        while True:
+            self._pending = self._pending.lstrip(JSON_WHITESPACE)
+            if len(self._pending) >= limit or self._eof:
+                return self._pending[:limit], self._eof and len(self._pending) <= limit
+            chunk = self._pull()
+            self._pending += chunk
+
+    def read(self, size: int = -1) -> bytes:
+        if size == 0:
+            # ijson probes the stream type with read(0)
+            return b""
+        if self._pending:
+            out, self._pending = self._pending, b""
+            return out
+        return self._pull()
+
+
+# --- FORMAT REGISTRY ---
+# Each export format is identified by a marker key on its conversation objects
+# and the JSON container it ships in. Detection reads a bounded prefix of the
+# bytes; the full parse only starts once a format has claimed the file.
+
+SNIFF_BYTES = 64 * 1024
+SNIFF_STEP = 4 * 1024  # small parser reads so a marker near the top exits early
+
+
+class ExportFormat:
+    def __init__(self, brand: str, marker: str, container: str):
+        self.brand = brand
+        self.marker = marker
+        self.container = container  # "array" of conversations or a single "object"
+
+    def prepare(self, conv: Dict[str, Any], filename: Optional[str]) -> Dict[str, Any]:
+        return conv
+
+
+class GeminiFormat(ExportFormat):
+    def prepare(self, conv: Dict[str, Any], filename: Optional[str]) -> Dict[str, Any]:
+        # Add a title if missing for UI niceness
+        if "title" not in conv:
+            conv["title"] = filename or "Gemini Chat"
+        return conv
+
+
+FORMATS: Dict[str, ExportFormat] = {}
+CONTAINERS = {b"[": ("array", "item"), b"{": ("object", "")}  # first byte -> (container, ijson path)
+
+
+def register_format(fmt: ExportFormat) -> ExportFormat:
+    FORMATS[fmt.brand] = fmt
+    return fmt
+
+
+register_format(ExportFormat("ChatGPT", "mapping", "array"))
+register_format(ExportFormat("Claude", "chat_messages", "array"))
+register_format(GeminiFormat("Gemini", "chunkedPrompt", "object"))
+
+
+def detect_brand(item: Any) -> Optional[str]:
+    if not isinstance(item, dict):
+        return None
+    for fmt in FORMATS.values():
+        if fmt.marker in item:
+            return fmt.brand
+    return None
+
+
+class Rejected(Exception):
+    """The bytes seen so far prove the file is not a supported export."""
+
+
+def sniff_format(prefix: bytes, complete: bool) -> Tuple[str, Optional[ExportFormat]]:
+    """Identify an export from the keys of its first conversation object.
+
+    Only key events are inspected; nothing is materialised. Returns the
+    container and the format, or (container, None) when the prefix ends before
+    the first object's marker key shows up. Raises Rejected when the prefix
+    alone settles it (wrong container, unknown keys, malformed JSON).
+    """
+    container, path = CONTAINERS.get(prefix[:1], (None, None))
+    if container is None:
+        raise Rejected("not a JSON array or object")
+    candidates = {fmt.marker: fmt for fmt in FORMATS.values() if fmt.container == container}
+    try:
+        for key_path, event, value in ijson.parse(io.BytesIO(prefix), buf_size=SNIFF_STEP):
+            if key_path != path:
+                continue
+            if event == "map_key":
+                if value in candidates:
+                    return container, candidates[value]
+            elif event == "end_map":
+                raise Rejected("no known marker key")
+            elif event != "start_map":
+                raise Rejected("conversation is not an object")
+    except ijson.IncompleteJSONError:
+        if complete:
+            raise Rejected("truncated JSON")
+        return container, None
+    except ijson.JSONError:
+        raise Rejected("malformed JSON")
+    raise Rejected("empty export")
+
+
+# --- ZIP EXPORTS ---
+# ChatGPT and Claude deliver their exports as zips. Members are decompressed
+# as a stream straight into the JSON path; nothing is extracted to disk.
+# Every JSON member goes through the sniffer, so users.json, projects.json and
+# friends are rejected from their first bytes.
+
+ZIP_MAGIC = b"PK\x03\x04"
+
+
+def iter_zip(raw: BinaryIO, filename: Optional[str] = None, conv_filter: Optional[ConversationFilter] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    try:
+        archive = zipfile.ZipFile(raw)
+    except zipfile.BadZipFile:
+        log_event("ingest_rejected", filename=filename, reason="corrupt zip")
+        return
+    with archive:
+        for info in archive.infolist():
+            name = info.filename
+            base = os.path.basename(name)
+            stem, ext = os.path.splitext(base)
+            # JSON members, plus extensionless ones (AI Studio prompts); skip media, html, etc.
+            if info.is_dir() or not stem or base.startswith(".") or "__MACOSX" in name or ext.lower() not in ("", ".json"):
+                continue
+            try:
+                member = archive.open(info)
+            except (zipfile.BadZipFile, NotImplementedError, RuntimeError) as e:
+                # Encrypted or unsupported compression
+                log_event("ingest_rejected", filename=f"{filename}:{name}", reason=str(e))
+                continue
+            with member:
+                yield from iter_json(member, stem, conv_filter)
+
+
+def iter_export(raw: BinaryIO, filename: Optional[str] = None, conv_filter: Optional[ConversationFilter] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yield (brand, conversation) pairs from a single upload: a JSON export or an export zip.
+
+    With conv_filter only matching conversations come out.
+    """
+    head = raw.read(len(ZIP_MAGIC))
+    raw.seek(0)
+    if head == ZIP_MAGIC:
+        # zipfile reads the (small) compressed stream through the file object
+        yield from iter_zip(raw, filename, conv_filter)
+        return
+    mapped = map_upload(raw)
+    try:
+        yield from iter_json(mapped if mapped is not None else raw, filename, conv_filter)
+    finally:
+        if mapped is not None:
+            mapped.close()
+
+
+def iter_json(raw: BinaryIO, filename: Optional[str] = None, conv_filter: Optional[ConversationFilter] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yield (brand, conversation) pairs from a single JSON export, one at a time.
+
+    The format is sniffed from the first SNIFF_BYTES, so unknown files are
+    dropped without a parse. ChatGPT and Claude ship a top-level array of
+    conversations, walked item by item; Gemini ships one conversation per file.
+    conv_filter is applied to each conversation as soon as it is parsed.
+    """
+    reader = ScrubbedReader(raw)
+    kept = dropped = 0
+    try:
+        prefix, complete = reader.prefix(SNIFF_BYTES)
+        container, fmt = sniff_format(prefix, complete)
+        path = CONTAINERS[prefix[:1]][1]
+        conversations = ijson.items(reader, path, use_float=True)
+        if fmt is None:
+            # Marker key sits past the sniff window (e.g. a huge first title)
+            first = next(conversations, None)
+            fmt = FORMATS.get(detect_brand(first))
+            if fmt is None or fmt.container != container:
+                raise Rejected("no known marker key")
+            conversations = chain([first], conversations)
+        for conv in conversations:
+            conv = fmt.prepare(conv, filename)
+            if conv_filter is not None and not conv_filter.matches(fmt.brand, conv):
+                # Dropped as it comes off the parser: never held, batched or refined
+                dropped += 1
+                continue
+            kept += 1
+            yield fmt.brand, conv
+    except Rejected as e:
+        log_event("ingest_rejected", filename=filename, reason=str(e))
+    except (ijson.JSONError, zipfile.BadZipFile, zlib.error, EOFError):
+        log_event("ingest_parse_failed", filename=filename)
+    finally:
+        if reader.replaced:
+            log_event("ingest_invalid_utf8", filename=filename, bytes_read=reader.bytes_read)
+        if conv_filter is not None and (kept or dropped):
+            log_event("ingest_filtered", filename=filename, kept=kept, dropped=dropped)
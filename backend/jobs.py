@@ -0,0 +1,336 @@
+import asyncio
+import os
+import tempfile
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from itertools import islice
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from metrics import log_event
+
+# THE DISPATCH BOARD: CONNECTION-INDEPENDENT REFINE JOBS
+# A /refine-stream batch runs as a job on the event loop whether or not anyone
+# is listening. At most max_live jobs exist unfinished at once (submit raises
+# JobsFull past that); a TOLL job spends minutes asleep, so only their refine
+# phases take one of max_running slots. Every SSE frame a job produces is
+# appended to its log, UTF-8 encoded, under a sequential event id:
+#
+#   attach(last_event_id)   replays frames after that id, then follows live
+#   retention               finished jobs stay attachable for retention_seconds
+#                           (and at most max_retained of them are kept)
+#   buffer                  a job keeps at most max_bytes of frames in memory
+#                           (and all jobs together at most the manager's
+#                           max_bytes); older frames spill to a temp file,
+#                           written off the event loop, and replays read them
+#                           back from there
+#   backpressure            while a listener is attached, the job waits once
+#                           it is max_bytes ahead of the fastest one
+#
+# A dropped client reconnects with Last-Event-ID and resumes where it left
+# off; the server never refines the same batch twice.
+
+KEEPALIVE_SECONDS = 15.0
+FINISHED = ("done", "failed", "cancelled")
+
+
+class JobsFull(Exception):
+    """Raised by submit() while max_live jobs are still unfinished."""
+
+
+class Job:
+    def __init__(
+        self,
+        job_id: str,
+        max_bytes: int = 8 * 1024 * 1024,
+        resized: Optional[Callable[[int], None]] = None,
+        over_budget: Optional[Callable[[], Awaitable[None]]] = None,
+    ):
+        self.job_id = job_id
+        self.status = "queued"
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self.max_bytes = max_bytes
+        self.events = 0
+        # Frames [spilled, events) are in memory; [0, spilled) live in the spill file
+        self.spilled = 0
+        self.memory = 0
+        self._frames: Deque[bytes] = deque()
+        self._ends: List[int] = []  # cumulative frame bytes after each event id
+        self._spill = None
+        self._spill_at: List[Tuple[int, int]] = []  # (offset, length) per spilled event id
+        self._spilling = asyncio.Lock()
+        self._closed = False
+        self._resized = resized
+        self._over_budget = over_budget
+        self._cursors: Dict[object, int] = {}  # last event id handed to each live listener
+        self._moved = asyncio.Event()
+        self._changed = asyncio.Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.status in FINISHED
+
+    @property
+    def listeners(self) -> int:
+        return len(self._cursors)
+
+    def _account(self, delta: int):
+        self.memory += delta
+        if self._resized is not None:
+            self._resized(delta)
+
+    def _lag(self) -> int:
+        if not self._cursors:
+            return 0
+        # Cursors are clamped on attach; clamp again so a stray one can never fail the producer
+        cursor = min(max(self._cursors.values()), len(self._ends) - 1)
+        return (self._ends[-1] if self._ends else 0) - (self._ends[cursor] if cursor >= 0 else 0)
+
+    def _write_spill(self, frames: List[bytes]):
+        if self._closed:
+            return
+        if self._spill is None:
+            self._spill = tempfile.TemporaryFile(prefix=f"job-{self.job_id}-", buffering=0)
+        self._spill.seek(0, os.SEEK_END)
+        self._spill.writelines(frames)
+
+    async def spill(self, keep_bytes: int = 0):
+        """Move the oldest in-memory frames to the spill file until at most keep_bytes remain.
+
+        The write runs on a worker thread; the frames stay readable from memory until it lands.
+        """
+        async with self._spilling:
+            count, freed = 0, 0
+            for data in self._frames:
+                if self.memory - freed <= keep_bytes:
+                    break
+                count += 1
+                freed += len(data)
+            if not count:
+                return
+            frames = list(islice(self._frames, count))
+            try:
+                await asyncio.to_thread(self._write_spill, frames)
+            except (OSError, ValueError):
+                if not self._closed:
+                    raise
+            if self._closed:
+                # Expired or shut down while the write was in flight
+                return
+            offset = self._spill_at[-1][0] + self._spill_at[-1][1] if self._spill_at else 0
+            for data in frames:
+                self._spill_at.append((offset, len(data)))
+                offset += len(data)
+                self._frames.popleft()
+            self.spilled += count
+            self._account(-freed)
+
+    def _read_spilled(self, event_id: int) -> str:
+        offset, length = self._spill_at[event_id]
+        return os.pread(self._spill.fileno(), length, offset).decode("utf-8")
+
+    async def frame(self, event_id: int) -> str:
+        if event_id >= self.spilled:
+            return self._frames[event_id - self.spilled].decode("utf-8")
+        return await asyncio.to_thread(self._read_spilled, event_id)
+
+    async def emit(self, frame: str):
+        data = frame.encode("utf-8")
+        # A live listener that fell max_bytes behind holds the producer (no listener: keep going, spilling)
+        while self._lag() > self.max_bytes:
+            self._moved.clear()
+            await self._moved.wait()
+        async with self._changed:
+            self._frames.append(data)
+            self._ends.append((self._ends[-1] if self._ends else 0) + len(data))
+            self.events += 1
+            self._account(len(data))
+            self._changed.notify_all()
+        if self.memory > self.max_bytes:
+            await self.spill(self.max_bytes)
+        if self._over_budget is not None:
+            await self._over_budget()
+
+    async def _finish(self, status: str):
+        async with self._changed:
+            self.status = status
+            self.finished = time.time()
+            self._changed.notify_all()
+
+    async def _wait_past(self, event_id: int):
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.events > event_id + 1 or self.done)
+
+    async def attach(self, last_event_id: int = -1) -> AsyncIterator[Tuple[Optional[int], str]]:
+        """(event id, frame) pairs after last_event_id, live until the job finishes.
+
+        Yields (None, keepalive comment) while idle so proxies keep the socket open.
+        An id outside [-1, events) is clamped into it.
+        """
+        event_id = max(-1, min(last_event_id, self.events - 1))
+        token = object()
+        self._cursors[token] = event_id
+        try:
+            while True:
+                while event_id + 1 < self.events:
+                    event_id += 1
+                    yield event_id, await self.frame(event_id)
+                    # The send went through; let a producer held by backpressure move on
+                    self._cursors[token] = event_id
+                    self._moved.set()
+                if self.done:
+                    return
+                try:
+                    await asyncio.wait_for(self._wait_past(event_id), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield None, ": keepalive\n\n"
+        finally:
+            del self._cursors[token]
+            self._moved.set()
+
+    def close(self):
+        self._closed = True
+        self._frames.clear()
+        self._account(-self.memory)
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+    def summary(self) -> Dict[str, object]:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "events": self.events,
+            "spilled": self.spilled,
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+
+class JobManager:
+    def __init__(
+        self,
+        max_running: int = 4,
+        retention_seconds: float = 300,
+        max_retained: int = 256,
+        job_max_bytes: int = 8 * 1024 * 1024,
+        max_bytes: int = 256 * 1024 * 1024,
+        max_live: int = 64,
+    ):
+        self.max_running = max(1, max_running)
+        self.max_live = max(1, max_live)
+        self.retention_seconds = retention_seconds
+        self.max_retained = max_retained
+        self.job_max_bytes = job_max_bytes
+        self.max_bytes = max_bytes
+        self.memory = 0
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._relieving = False
+
+    def _resized(self, delta: int):
+        self.memory += delta
+
+    async def _relieve(self):
+        """Over the shared budget: spill finished jobs first, then the oldest running ones.
+
+        One pass at a time; emitters arriving meanwhile do not pile on.
+        """
+        if self.memory <= self.max_bytes or self._relieving:
+            return
+        self._relieving = True
+        try:
+            for job in sorted(self._jobs.values(), key=lambda j: (not j.done, j.created)):
+                if self.memory <= self.max_bytes:
+                    return
+                await job.spill(0)
+        finally:
+            self._relieving = False
+
+    @property
+    def live(self) -> int:
+        return sum(1 for job in self._jobs.values() if not job.done)
+
+    @property
+    def full(self) -> bool:
+        return self.live >= self.max_live
+
+    def _expire(self):
+        now = time.time()
+        # A job someone is still reading from stays until they detach
+        finished = [j for j in self._jobs.values() if j.done and not j.listeners]
+        overflow = len(finished) - self.max_retained
+        for job in finished:
+            if overflow > 0 or now - job.finished > self.retention_seconds:
+                del self._jobs[job.job_id]
+                job.close()
+                overflow -= 1
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one of max_running refine slots. Wrap CPU phases only, never a toll sleep."""
+        if self._slots is None:
+            # Created lazily so it binds to the serving event loop
+            self._slots = asyncio.Semaphore(self.max_running)
+        async with self._slots:
+            yield
+
+    async def _run(self, job: Job, produce: Callable[[Job], Awaitable[None]]):
+        status = "failed"
+        try:
+            job.status = "running"
+            await produce(job)
+            status = "done"
+        except asyncio.CancelledError:
+            status = "cancelled"
+        except Exception as e:
+            log_event("job_failed", job_id=job.job_id, error=str(e))
+        finally:
+            await job._finish(status)
+
+    def submit(self, produce: Callable[[Job], Awaitable[None]]) -> Job:
+        """Start a job whose frames come from produce(job); it runs until done or cancelled."""
+        self._expire()
+        if self.full:
+            raise JobsFull(f"{self.max_live} jobs already running")
+        job = Job(uuid.uuid4().hex, self.job_max_bytes, self._resized, self._relieve)
+        self._jobs[job.job_id] = job
+        job.task = asyncio.get_running_loop().create_task(self._run(job, produce))
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._expire()
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.get(job_id)
+        if job is None or job.done or job.task is None:
+            return False
+        job.task.cancel()
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        self._expire()
+        counts = {"queued": 0, "running": 0, "done": 0, "failed": 0, "cancelled": 0}
+        for job in self._jobs.values():
+            counts[job.status] += 1
+        return counts
+
+    def buffer_stats(self) -> Dict[str, int]:
+        return {
+            "memory_bytes": self.memory,
+            "live_jobs": self.live,
+            "spilled_events": sum(job.spilled for job in self._jobs.values()),
+        }
+
+    async def shutdown(self):
+        for job in list(self._jobs.values()):
+            if job.task is not None and not job.done:
+                job.task.cancel()
+        tasks = [job.task for job in self._jobs.values() if job.task is not None]
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for job in self._jobs.values():
+            job.close()
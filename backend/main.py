@@ -1,39 +1,229 @@
 import os
 import json
-import zipfile
 import io
 import re
 import time # Added for archival timestamps
 import asyncio
-from typing import List, Optional, Dict, Any
+import html
+import hashlib
+import hmac
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from itertools import islice
+from typing import List, Optional, Dict, Any, Iterable, Iterator, Tuple
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request # Added Request
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from starlette.formparsers import MultiPartParser
+from pydantic import BaseModel, ValidationError, field_validator
+
+from ingest import iter_export
+from sessions import SessionCache, UploadSession, hash_uploads, scoped_session_id
+from filters import ConversationFilter, to_epoch
+from zipstream import PROFILES, ZIP_EPOCH, stream_zip
+from executor import executor_from_env
+from chatgpt_tree import BranchStrategy, ConversationTree
+from vault import Vault
+from search import SearchIndex
+from rendercache import RenderCache
+from artifacts import ArtifactCache, ArtifactResponse, etag_matches
+from planner import plan_batches, take_batch, conversation_cost
+from jobs import Job, JobManager, JobsFull
+from metrics import (
+    REGISTRY, STAGE_SECONDS, BYTES_INGESTED, BYTES_SENT, CONVERSATIONS, MESSAGES, INFLIGHT,
+    RequestTrace, log_event, monitor_event_loop,
+)
 
 # SPLIT IDENTITY DOCTRINE
 # SIPHON: Fast, Professional, Data Archival Enabled.
 # TOLL: Gritty, Monetized, 5-min Lock, Stateless (save-aichats.com default).
 SITE_PERSONALITY = os.getenv("SITE_PERSONALITY", "TOLL").upper()
 
-app = FastAPI(title="THE WASHHOUSE: AI LOG REFINERY")
+# PARSED UPLOAD SESSIONS: bounded by estimated parsed bytes, LRU + TTL eviction
+# SESSION_PARSE_FACTOR: assumed parsed/raw ratio when deciding whether an upload is worth parsing
+SESSION_CACHE = SessionCache(
+    max_bytes=int(os.getenv("SESSION_CACHE_MAX_MB", "512")) * 1024 * 1024,
+    max_sessions=int(os.getenv("SESSION_CACHE_MAX_SESSIONS", "32")),
+    ttl_seconds=float(os.getenv("SESSION_CACHE_TTL", "900")),
+    parse_factor=float(os.getenv("SESSION_PARSE_FACTOR", "4")),
+)
+
+# LARGE UPLOADS: multipart files past INGEST_SPOOL_MB are spooled to a temp file
+# and parsed, hashed and archived through mmap instead of heap copies
+MultiPartParser.max_file_size = int(float(os.getenv("INGEST_SPOOL_MB", "1")) * 1024 * 1024)
+
+# BATCH PLANNER: batches are cut at BATCH_BUDGET_MB of estimated work, never
+# more than 20 chats (the toll schedule is defined for N <= 20)
+BATCH_BUDGET = int(float(os.getenv("BATCH_BUDGET_MB", "4")) * 1024 * 1024)
+BATCH_MAX = 20
+
+# REFINEMENT WORKERS: REFINERY_WORKERS (default: all cores), REFINERY_POOL=process|thread
+# Every job reports its worker-side duration to the "refine" stage histogram
+REFINE_EXECUTOR = executor_from_env(observe=lambda seconds: STAGE_SECONDS.observe(seconds, stage="refine"))
+
+# DEFLATE WORKERS: zip entries compress on ZIP_WORKERS threads (default: all cores, 0 = inline)
+ZIP_WORKERS = int(os.getenv("ZIP_WORKERS", str(os.cpu_count() or 1)))
+ZIP_EXECUTOR = ThreadPoolExecutor(max_workers=ZIP_WORKERS, thread_name_prefix="deflate") if ZIP_WORKERS > 0 else None
+
+# THE VAULT (SIPHON only): content-addressed, deduplicated, written off the request path
+VAULT = Vault(os.getenv("VAULT_DIR", "vault"), compress=os.getenv("VAULT_COMPRESS", "1") != "0")
+
+# THE LEDGER (opt-in, SEARCH_INDEX=1): FTS5 index of everything /refine-stream welds.
+# Session scopes expire after SEARCH_TTL; SIPHON keeps its index forever
+SEARCH = SearchIndex(
+    os.getenv("SEARCH_DB", "search.db"),
+    ttl_seconds=0 if SITE_PERSONALITY == "SIPHON" else float(os.getenv("SEARCH_TTL", "86400")),
+) if os.getenv("SEARCH_INDEX", "0") == "1" else None
+
+# THE GAUGES: /metrics wants "Authorization: Bearer $METRICS_TOKEN" (off when unset)
+# unless METRICS_PUBLIC=1. The peer address proves nothing: behind a same-host
+# reverse proxy every client is 127.0.0.1.
+# TRACE_REQUESTS=1 (or an X-Washhouse-Trace header) logs a per-request span trace.
+METRICS_PUBLIC = os.getenv("METRICS_PUBLIC", "0") == "1"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+TRACE_REQUESTS = os.getenv("TRACE_REQUESTS", "0") == "1"
+
+# THE DISPATCH BOARD: /refine-stream batches run as jobs that outlive the connection.
+# At most REFINE_JOBS are refining at once (tolls are paid outside that limit);
+# finished jobs stay attachable via /jobs/{id}/events + Last-Event-ID for JOB_RETENTION seconds.
+# Frames past JOB_BUFFER_MB per job (JOB_MEMORY_MB across jobs) spill to a temp file.
+# Once JOB_MAX_LIVE jobs are unfinished, /refine-stream answers 429 TOO_MANY_JOBS.
+JOBS = JobManager(
+    max_running=int(os.getenv("REFINE_JOBS", "32")),
+    retention_seconds=float(os.getenv("JOB_RETENTION", "300")),
+    job_max_bytes=int(float(os.getenv("JOB_BUFFER_MB", "8")) * 1024 * 1024),
+    max_bytes=int(float(os.getenv("JOB_MEMORY_MB", "256")) * 1024 * 1024),
+    max_live=int(os.getenv("JOB_MAX_LIVE", "64")),
+)
+
+REGISTRY.gauge(
+    "washhouse_session_cache", "Parsed upload cache occupancy and counters.",
+    lambda: {(("stat", k),): v for k, v in SESSION_CACHE.stats().items()},
+)
+REGISTRY.gauge(
+    "washhouse_vault", "SIPHON vault archival counters.",
+    lambda: {(("stat", k),): v for k, v in VAULT.stats().items()},
+)
+REGISTRY.gauge(
+    "washhouse_render_cache", "Rendered entry cache hits, misses and stores.",
+    lambda: {(("stat", k),): v for k, v in RENDER_CACHE.stats().items()} if RENDER_CACHE is not None else {},
+)
+REGISTRY.gauge(
+    "washhouse_artifacts", "Stored /refine zip hits, misses and builds.",
+    lambda: {(("stat", k),): v for k, v in ARTIFACTS.stats().items()} if ARTIFACTS is not None else {},
+)
+REGISTRY.gauge(
+    "washhouse_jobs", "Refine jobs held by the dispatch board, by status.",
+    lambda: {(("status", k),): v for k, v in JOBS.stats().items()},
+)
+REGISTRY.gauge(
+    "washhouse_job_buffer", "Job frames held in memory (bytes) and spilled to disk (events).",
+    lambda: {(("stat", k),): v for k, v in JOBS.buffer_stats().items()},
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    lag_probe = asyncio.create_task(monitor_event_loop())
+    yield
+    lag_probe.cancel()
+    await JOBS.shutdown()
+    REFINE_EXECUTOR.shutdown()
+    if ZIP_EXECUTOR is not None:
+        ZIP_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+    VAULT.shutdown()
+    if SEARCH is not None:
+        SEARCH.shutdown()
+    if RENDER_CACHE is not None:
+        RENDER_CACHE.shutdown()
+    if ARTIFACTS is not None:
+        ARTIFACTS.shutdown()
+
+app = FastAPI(title="THE WASHHOUSE: AI LOG REFINERY", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Washhouse-Session", "X-Washhouse-Job", "X-Washhouse-Artifact", "X-Washhouse-Next-Index", "ETag", "Accept-Ranges", "Content-Range"],
 )
 
 # --- MODELS ---
 
+class ConversationQuery(BaseModel):
+    title: Optional[str] = None # Case-insensitive regex, searched in the title (Claude: name)
+    created_after: Optional[float | str] = None # Epoch seconds or ISO 8601; after is inclusive, before exclusive
+    created_before: Optional[float | str] = None
+    updated_after: Optional[float | str] = None
+    updated_before: Optional[float | str] = None
+    ids: List[str] = [] # ChatGPT id / conversation_id, Claude uuid
+    min_messages: int = 0
+
+    @field_validator("title")
+    @classmethod
+    def title_compiles(cls, value: Optional[str]) -> Optional[str]:
+        if value:
+            try:
+                re.compile(value)
+            except re.error as e:
+                raise ValueError(f"not a valid regex: {e}")
+        return value
+
+    @field_validator("created_after", "created_before", "updated_after", "updated_before")
+    @classmethod
+    def readable_time(cls, value: Optional[float | str]) -> Optional[float | str]:
+        if value is not None and to_epoch(value) is None:
+            raise ValueError("not an epoch or ISO 8601 time")
+        return value
+
 class RefineryOptions(BaseModel):
     include_user: bool = True
     include_bot: bool = True
     include_thoughts: bool = False
     output_format: str = "md"
+    output_formats: List[str] = [] # Multi-format export from one parse: any of md, txt, json, html
+    branch_strategy: BranchStrategy = "last_child" # ChatGPT forks: last_child (PLAY A) | current_node | all_branches
+    message_chunks: bool = False # /refine-stream: big conversations arrive as sequenced 'chunk' events
+    zip_profile: str = "balanced" # /refine archive compression: store | balanced | max
+    filter: Optional[ConversationQuery] = None # Only matching conversations are kept, batched and refined
     base_filename: str = "WASHHOUSE_PAYLOAD"
 
+    def formats(self) -> List[str]:
+        requested = self.output_formats or [self.output_format]
+        formats = [fmt for fmt in dict.fromkeys(f.lower().strip(".") for f in requested) if fmt in RENDERERS]
+        return formats or ["md"]
+
+    def archive_profile(self) -> str:
+        return self.zip_profile if self.zip_profile in PROFILES else "balanced"
+
+    @classmethod
+    def from_form(cls, options_json: str) -> "RefineryOptions":
+        """Parse the options_json form field; anything malformed is the client's 422, not our 500."""
+        try:
+            return cls(**json.loads(options_json))
+        except (ValueError, TypeError) as e:
+            detail = e.errors(include_url=False, include_context=False) if isinstance(e, ValidationError) else str(e)
+            raise HTTPException(status_code=422, detail=detail)
+
+    def conversation_filter(self) -> Optional[ConversationFilter]:
+        """The compiled filter; None when no filter (or an empty one) was given."""
+        if self.filter is None:
+            return None
+        compiled = ConversationFilter(**self.filter.model_dump(), branch_strategy=self.branch_strategy)
+        return compiled if compiled.active else None
+
+    def render_key(self) -> Dict[str, Any]:
+        """The options that change a conversation's rendered entries (render cache key material)."""
+        return {
+            "include_user": self.include_user,
+            "include_bot": self.include_bot,
+            "include_thoughts": self.include_thoughts,
+            "branch_strategy": self.branch_strategy,
+            "formats": self.formats(),
+        }
+
 # --- ASCII ART ASSETS ---
 
 ASCII_PATH = os.path.join(os.path.dirname(__file__), "..", "ascii")
@@ -85,95 +275,201 @@ def clean_filename(name: str) -> str:
     cleaned = re.sub(r'[^a-zA-Z0-9.-]', '', cleaned)
     return cleaned.strip('.')
 
+# --- RENDERER ---
+
+class HeaderTemplates:
+    """Message headers precompiled once per (role, brand, divider slot).
+
+    Only the zero-padded entry number is filled in per message.
+    """
+
+    def __init__(self, brands: Iterable[str]):
+        self._compiled: Dict[Tuple[str, Optional[str], int], Tuple[str, str]] = {}
+        for slot in range(len(DIVIDERS)):
+            self._compile("user", None, slot)
+            for brand in brands:
+                self._compile("model", brand, slot)
+
+    def _compile(self, role: str, brand: Optional[str], slot: int) -> Tuple[str, str]:
+        top_div, bot_div = DIVIDERS[slot]
+        if role == "user":
+            template = (f"{top_div}\n{USER_HEADER}\n[USER ENTRY #", f"]\n{bot_div}")
+        else:
+            art = GEMINI_HEADER if brand.lower() == "gemini" else CLAUDE_HEADER
+            template = (f"{top_div}\n{art}\n[{brand.upper()} RESPONSE #", f"]\n{bot_div}")
+        self._compiled[(role, brand, slot)] = template
+        return template
+
+    def header(self, role: str, brand: str, index: int) -> str:
+        # Use different dividers based on index to keep it fresh
+        key = ("user", None, index % len(DIVIDERS)) if role == "user" else ("model", brand, index % len(DIVIDERS))
+        head, tail = self._compiled.get(key) or self._compile(*key)
+        return f"{head}{str(index).zfill(3)}{tail}"
+
+HEADERS = HeaderTemplates(("ChatGPT", "Claude", "Gemini"))
+
+# Bump when rendering changes; the ASCII assets are hashed in automatically
+RENDER_VERSION = 2
+RENDER_SALT = hashlib.sha256(repr((RENDER_VERSION, USER_HEADER, GEMINI_HEADER, CLAUDE_HEADER, DIVIDERS)).encode("utf-8")).hexdigest()
+
+# RENDER CACHE: refined entries per (conversation fingerprint, options, title) so
+# re-exports only refine new/changed chats. On by default for SIPHON only (TOLL is
+# stateless); RENDER_CACHE=0|1 overrides
+RENDER_CACHE = RenderCache(
+    os.getenv("RENDER_CACHE_DIR", "render_cache"),
+    max_bytes=int(os.getenv("RENDER_CACHE_MAX_MB", "1024")) * 1024 * 1024,
+    salt=RENDER_SALT,
+) if os.getenv("RENDER_CACHE", "1" if SITE_PERSONALITY == "SIPHON" else "0") == "1" else None
+
+# THE WAREHOUSE: finished /refine zips per (upload hash, batch, options), served
+# with ETag/If-None-Match and Range from disk. Same default as the render cache;
+# ARTIFACT_CACHE=0|1 overrides
+ARTIFACTS = ArtifactCache(
+    os.getenv("ARTIFACT_DIR", "artifacts"),
+    max_bytes=int(os.getenv("ARTIFACT_CACHE_MAX_MB", "2048")) * 1024 * 1024,
+    salt=RENDER_SALT,
+) if os.getenv("ARTIFACT_CACHE", "1" if SITE_PERSONALITY == "SIPHON" else "0") == "1" else None
+
+def render_message(header: str, text: str) -> Iterator[str]:
+    """Yield one message's output in chunks; the text itself is never copied."""
+    yield f"\n{header}\n\n"
+    yield text
+    yield "\n\n"
+
 def format_message(role: str, text: str, brand: str, index: int) -> str:
-    # Use different dividers based on index to keep it fresh
-    div_pair = DIVIDERS[index % len(DIVIDERS)]
-    top_div, bot_div = div_pair
-    
-    if role == "user":
-        header = f"{top_div}\n{USER_HEADER}\n[USER ENTRY #{str(index).zfill(3)}]\n{bot_div}"
-        return f"\n{header}\n\n{text}\n\n"
-    else:
-        art = GEMINI_HEADER if brand.lower() == "gemini" else CLAUDE_HEADER
-        label = brand.upper()
-        header = f"{top_div}\n{art}\n[{label} RESPONSE #{str(index).zfill(3)}]\n{bot_div}"
-        return f"\n{header}\n\n{text}\n\n"
+    return "".join(render_message(HEADERS.header(role, brand, index), text))
+
+class RefinedMessage:
+    """Compact message record. Merged chunks pile up as fragments and are joined once."""
+    __slots__ = ("role", "is_thought", "fragments")
+
+    def __init__(self, role: str, text: str, is_thought: bool):
+        self.role = role
+        self.is_thought = is_thought
+        self.fragments = [text]
+
+    @property
+    def text(self) -> str:
+        if len(self.fragments) > 1:
+            self.fragments = ["\n".join(self.fragments)]
+        return self.fragments[0]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"role": self.role, "text": self.text, "is_thought": self.is_thought}
 
 class LogRefiner:
     def __init__(self, brand: str, options: RefineryOptions):
         self.brand = brand
         self.options = options
-        self.extracted: List[Dict[str, Any]] = []
+        self.extracted: List[RefinedMessage] = []
 
-    def push_or_merge(self, role: str, text: str, is_thought: bool = False):
-        if not text or not text.strip(): return
-        if self.extracted:
+    def push_or_merge(self, role: str, text: str, is_thought: bool = False, new_turn: bool = False):
+        if not text: return
+        text = text.strip()
+        if not text: return
+        if self.extracted and not new_turn:
             last = self.extracted[-1]
-            if last['role'] == role and last.get('is_thought') == is_thought:
-                last['text'] += "\n" + text.strip()
+            if last.role == role and last.is_thought == is_thought:
+                # Linear merge: fragments are joined once, when the text is read
+                last.fragments.append(text)
                 return
-        self.extracted.append({"role": role, "text": text.strip(), "is_thought": is_thought})
+        self.extracted.append(RefinedMessage(role, text, is_thought))
+
+    def visible(self) -> Iterator[RefinedMessage]:
+        for msg in self.extracted:
+            if not self.options.include_thoughts and msg.is_thought: continue
+            if not self.options.include_user and msg.role == "user": continue
+            if not self.options.include_bot and msg.role == "model": continue
+            yield msg
+
+    def numbered(self) -> Iterator[Tuple[RefinedMessage, str]]:
+        """Visible messages paired with their rendered headers (user/bot numbered separately)."""
+        user_idx, bot_idx = 1, 1
+        for msg in self.visible():
+            if msg.role == "user":
+                yield msg, HEADERS.header("user", self.brand, user_idx)
+                user_idx += 1
+            else:
+                yield msg, HEADERS.header(msg.role, self.brand, bot_idx)
+                bot_idx += 1
 
     def get_refined_messages(self) -> List[Dict[str, Any]]:
         output = []
-        for msg in self.extracted:
-            if not self.options.include_thoughts and msg.get("is_thought"): continue
-            if not self.options.include_user and msg["role"] == "user": continue
-            if not self.options.include_bot and msg["role"] == "model": continue
-            output.append(msg)
+        for msg, header in self.numbered():
+            record = msg.to_dict()
+            record["ascii_header"] = header
+            output.append(record)
         return output
 
+    def iter_refined_chunks(self) -> Iterator[str]:
+        for msg, header in self.numbered():
+            yield from render_message(header, msg.text)
+
     def get_refined_content(self) -> str:
-        output = []
-        user_idx, bot_idx = 1, 1
-        for msg in self.extracted:
-            role = msg.get("role")
-            if not self.options.include_thoughts and msg.get("is_thought"): continue
-            if not self.options.include_user and role == "user": continue
-            if not self.options.include_bot and role == "model": continue
-            
-            current_idx = user_idx if role == "user" else bot_idx
-            formatted = format_message(role, msg["text"], self.brand, current_idx)
-            output.append(formatted)
-            
-            # Update msg for stream if needed (add the ascii art version)
-            msg["ascii_header"] = formatted.split("\n\n")[0].strip()
-            
-            if role == "user": user_idx += 1
-            else: bot_idx += 1
-        return "".join(output)
+        return "".join(self.iter_refined_chunks())
+
+# --- OUTPUT FORMATS ---
+# Every renderer reads the same extracted messages off the refiner; adding a
+# format costs rendering only, never another ingest.
+
+def render_text(refiner: LogRefiner, title: str) -> Iterator[str]:
+    return refiner.iter_refined_chunks()
+
+def render_json(refiner: LogRefiner, title: str) -> Iterator[str]:
+    yield f'{{"title": {json.dumps(title)}, "brand": {json.dumps(refiner.brand)}, "messages": ['
+    for idx, msg in enumerate(refiner.visible()):
+        yield ("," if idx else "") + "\n  " + json.dumps(msg.to_dict(), ensure_ascii=False)
+    yield "\n]}\n"
+
+def render_html(refiner: LogRefiner, title: str) -> Iterator[str]:
+    yield (
+        f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{html.escape(title)}</title>\n'
+        '<style>body{background:#0b0b0b;color:#d4d4d4;font-family:monospace;max-width:960px;margin:auto;padding:2em}'
+        'pre{white-space:pre-wrap}.user .header{color:#00ff41}.model .header{color:#38bdf8}.thought{opacity:.6;font-style:italic}</style>\n'
+        f'</head><body>\n<h1>{html.escape(title)}</h1>\n'
+    )
+    for msg, header in refiner.numbered():
+        css = f"{msg.role} thought" if msg.is_thought else msg.role
+        yield f'<section class="{css}">\n<pre class="header">{html.escape(header)}</pre>\n<pre class="text">'
+        yield html.escape(msg.text)
+        yield "</pre>\n</section>\n"
+    yield "</body></html>\n"
+
+RENDERERS = {
+    "md": render_text,
+    "txt": render_text,
+    "json": render_json,
+    "html": render_html,
+}
 
 # --- BRAND HANDLERS ---
 
-def handle_chatgpt(conv: Dict[str, Any], options: RefineryOptions, raw: bool = False) -> Any:
+def extract_chatgpt(conv: Dict[str, Any], options: RefineryOptions) -> LogRefiner:
     refiner = LogRefiner("ChatGPT", options)
-    mapping = conv.get("mapping", {})
-    root_id = next((node_id for node_id, node in mapping.items() if node.get("parent") is None), None)
-    current_id = root_id
-    while current_id:
-        node = mapping[current_id]
-        msg_obj = node.get("message")
-        if msg_obj:
-            role = msg_obj.get("author", {}).get("role")
-            content = msg_obj.get("content", {})
-            parts = content.get("parts", [])
-            text = "".join([p if isinstance(p, str) else "" for p in parts])
-            if role in ["user", "assistant"] and text.strip():
-                refiner.push_or_merge("user" if role == "user" else "model", text)
-        children = node.get("children", [])
-        current_id = children[-1] if children else None
-    return refiner.get_refined_messages() if raw else refiner.get_refined_content()
+    tree = ConversationTree(conv.get("mapping", {}), conv.get("current_node"))
+    branch_start = False
+    for msg_obj, forked in tree.messages(options.branch_strategy):
+        # A sibling branch (all_branches) always opens a new message, even on the same role
+        branch_start = branch_start or forked
+        role = msg_obj.get("author", {}).get("role")
+        content = msg_obj.get("content", {})
+        parts = content.get("parts", [])
+        text = "".join([p if isinstance(p, str) else "" for p in parts])
+        if role in ["user", "assistant"] and text.strip():
+            refiner.push_or_merge("user" if role == "user" else "model", text, new_turn=branch_start)
+            branch_start = False
+    return refiner
 
-def handle_claude(chat: Dict[str, Any], options: RefineryOptions, raw: bool = False) -> Any:
+def extract_claude(chat: Dict[str, Any], options: RefineryOptions) -> LogRefiner:
     refiner = LogRefiner("Claude", options)
     for m in chat.get("chat_messages", []):
         sender = m.get("sender")
         content_blocks = m.get("content", [])
         text = "".join([b.get("text", "") for b in content_blocks if isinstance(b, dict) and b.get("type") == "text"])
         refiner.push_or_merge("user" if sender == "human" else "model", text)
-    return refiner.get_refined_messages() if raw else refiner.get_refined_content()
+    return refiner
 
-def handle_gemini(data: Dict[str, Any], options: RefineryOptions, raw: bool = False) -> Any:
+def extract_gemini(data: Dict[str, Any], options: RefineryOptions) -> LogRefiner:
     refiner = LogRefiner("Gemini", options)
     chunks = data.get("chunkedPrompt", {}).get("chunks", [])
     for chunk in chunks:
@@ -184,8 +480,251 @@ def handle_gemini(data: Dict[str, Any], options: RefineryOptions, raw: bool = Fa
                 text += "".join([p.get("text", "") for p in chunk["parts"] if isinstance(p, dict) and "text" in p])
             is_thought = chunk.get("isThought", False) or any(p.get("thought") for p in chunk.get("parts", []) if isinstance(p, dict))
             refiner.push_or_merge(role, text, is_thought)
+    return refiner
+
+def emit(refiner: LogRefiner, raw: bool) -> Any:
     return refiner.get_refined_messages() if raw else refiner.get_refined_content()
 
+def handle_chatgpt(conv: Dict[str, Any], options: RefineryOptions, raw: bool = False) -> Any:
+    return emit(extract_chatgpt(conv, options), raw)
+
+def handle_claude(chat: Dict[str, Any], options: RefineryOptions, raw: bool = False) -> Any:
+    return emit(extract_claude(chat, options), raw)
+
+def handle_gemini(data: Dict[str, Any], options: RefineryOptions, raw: bool = False) -> Any:
+    return emit(extract_gemini(data, options), raw)
+
+BRAND_EXTRACTORS = {
+    "ChatGPT": extract_chatgpt,
+    "Claude": extract_claude,
+    "Gemini": extract_gemini,
+}
+
+BRAND_HANDLERS = {
+    "ChatGPT": handle_chatgpt,
+    "Claude": handle_claude,
+    "Gemini": handle_gemini,
+}
+
+def display_name(brand: str, item: Dict[str, Any], position: int) -> str:
+    # If default name logic fails, use generic
+    return item.get("title") or item.get("name") or f"{brand}_Chat_{position}"
+
+def entry_name(title: str) -> str:
+    # SAFE NAME GENERATION
+    safe_name = clean_filename(title) # Ensure usage of clean_filename helper if available or simple replace
+    
+    # Since helper availability isn't guaranteed in this snippet scope, let's use robust local logic
+    safe_name = re.sub(r'[\s]+', '.', safe_name)
+    safe_name = re.sub(r'[^a-zA-Z0-9.-]', '', safe_name)
+    return safe_name
+
+# --- WORKER ENTRY POINTS (module level so the process pool can pickle them) ---
+
+def refine_conversation(brand: str, item: Dict[str, Any], options: RefineryOptions, raw: bool = False) -> Any:
+    return BRAND_HANDLERS[brand](item, options, raw=raw)
+
+def refine_entries(title: str, brand: str, item: Dict[str, Any], options: RefineryOptions) -> List[Tuple[str, List[str]]]:
+    """Extract once, then render every requested format off the same messages.
+
+    Rendered chunks go straight into the zip entries; never joined into one string.
+    """
+    refiner = BRAND_EXTRACTORS[brand](item, options)
+    name = entry_name(title)
+    return [(f"{name}.{fmt}", list(RENDERERS[fmt](refiner, title))) for fmt in options.formats()]
+
+# --- INGEST ---
+
+Upload = Tuple[Optional[str], Any]  # (filename, binary file object)
+
+def detach_uploads(files: Optional[List[UploadFile]]) -> List[Upload]:
+    """Take ownership of the spooled upload files.
+
+    FastAPI closes a request's UploadFiles as soon as the endpoint returns,
+    before a streaming body has been sent. Streaming bodies keep reading the
+    originals; FastAPI closes an empty placeholder instead.
+    """
+    uploads = []
+    for file in files or []:
+        BYTES_INGESTED.inc(file.size or 0)
+        uploads.append((file.filename, file.file))
+        file.file = io.BytesIO()
+    return uploads
+
+def iter_uploads(uploads: List[Upload], conv_filter: Optional[ConversationFilter] = None):
+    """Stream (brand, conversation) pairs across every uploaded file, in upload order."""
+    try:
+        for filename, raw in uploads:
+            raw.seek(0)
+            yield from iter_export(raw, filename, conv_filter)
+    finally:
+        for _, raw in uploads:
+            raw.close()
+
+def build_session(uploads: List[Upload], parsed: Optional[UploadSession], conv_filter: Optional[ConversationFilter], content_id: str, size: int) -> UploadSession:
+    """Parse the uploads (or narrow an unfiltered cached parse) into a new session, weighed and planned.
+
+    The weight is an estimate (see sessions.py). A filtered parse is charged
+    as the whole upload, since the parser does not report how much it dropped.
+
+    Runs in the threadpool: pricing every conversation for the batch plan
+    walks the whole session, so it happens here once, never per request.
+    """
+    scope = conv_filter.scope() if conv_filter else None
+    if parsed is not None:
+        conversations = [(brand, item) for brand, item in parsed.conversations if conv_filter.matches(brand, item)]
+        # A narrowed parse holds its share of the parent's weight
+        memory = parsed.memory * len(conversations) // max(1, len(parsed.conversations))
+    else:
+        conversations = list(iter_uploads(uploads, conv_filter))
+        memory = SESSION_CACHE.estimate(size)
+    session = UploadSession(scoped_session_id(content_id, scope), conversations, size, content_id, scope, memory)
+    session.batches = plan_batches([conversation_cost(brand, item) for brand, item in conversations], BATCH_BUDGET, BATCH_MAX)
+    return session
+
+UploadIdentity = Tuple[Optional[UploadSession], Optional[str], int]  # (session, content hash, upload bytes)
+
+async def identify_upload(uploads: List[Upload], session_id: Optional[str]) -> UploadIdentity:
+    """The referenced session if it is still cached, else the uploads' content hash (hashed in the threadpool)."""
+    session = SESSION_CACHE.get(session_id) if session_id else None
+    if session is not None:
+        return session, session.content_id, session.size
+    if uploads:
+        content_id, size = await run_in_threadpool(hash_uploads, uploads)
+        return None, content_id, size
+    return None, None, 0
+
+async def open_session(uploads: List[Upload], identity: UploadIdentity, conv_filter: Optional[ConversationFilter] = None) -> Tuple[Optional[UploadSession], Optional[Iterable]]:
+    """Resolve a request's conversations: a cached session, a fresh parse, or a plain stream.
+
+    Returns (session, conversations). conversations is None when the
+    referenced session expired and nothing was re-uploaded. A filtered parse
+    is its own session (keyed by content hash and filter) holding only the
+    matching conversations; the options' filter decides which one a request gets.
+    Parsing runs in the threadpool; the cache is only touched on the loop.
+    """
+    scope = conv_filter.scope() if conv_filter else None
+    session, content_id, size = identity
+    if content_id is not None and (session is None or session.scope != scope):
+        session = SESSION_CACHE.get(scoped_session_id(content_id, scope))
+        if session is None:
+            # An unfiltered parse of the same bytes already in the cache answers any filter
+            parsed = SESSION_CACHE.get(content_id) if scope is not None else None
+            if parsed is None and not uploads:
+                return None, None
+            if parsed is None and not SESSION_CACHE.admits_upload(size):
+                # Too big to park: stream it and re-parse on the next batch
+                return None, iter_uploads(uploads, conv_filter)
+            session = await run_in_threadpool(build_session, uploads, parsed, conv_filter, content_id, size)
+            if not session.conversations:
+                for _, raw in uploads:
+                    raw.close()
+                return None, []
+            SESSION_CACHE.put(session)
+    for _, raw in uploads:
+        raw.close()
+    if session is None:
+        return None, None
+    return session, session.conversations
+
+def select_batch(session: Optional[UploadSession], conversations: Optional[Iterable], start_index: int) -> Tuple[Iterator, Optional[List[Tuple[int, int]]]]:
+    """The batch starting at start_index, plus every planned boundary when the session is parsed.
+
+    A batch is always cut greedily from start_index (planner rule), so the same
+    start holds the same chats whether the upload is cached, streamed or
+    already stored as an artifact. Cached sessions are sliced at the plan
+    build_session made; any other start (an older client's fixed slices, a
+    streamed upload) is cut on the fly, so the batch stays lazy.
+    """
+    if session is None:
+        return take_batch(islice(conversations or [], start_index, None), BATCH_BUDGET, BATCH_MAX), None
+    end = dict(session.batches or ()).get(start_index)
+    if end is None:
+        return take_batch(islice(session.conversations, start_index, None), BATCH_BUDGET, BATCH_MAX), session.batches
+    return iter(session.conversations[start_index:end]), session.batches
+
+# SSE_CHUNK_KB: message payload per 'chunk' event when a client asks for message_chunks
+SSE_CHUNK_BYTES = int(os.getenv("SSE_CHUNK_KB", "64")) * 1024
+
+def welded_events(index: int, total: int, name: str, messages: List[Dict[str, Any]], chunked: bool) -> Iterator[str]:
+    """SSE frames for one refined conversation.
+
+    Chunked: messages go out as sequenced `chunk` events of about SSE_CHUNK_BYTES,
+    then a `welded` marker carrying no messages. Each message is serialized
+    once, and one frame's worth at a time, so a 40 MB conversation never blocks
+    the loop on a single json.dumps. A conversation that fits one chunk is sent whole.
+    """
+    head = {"status": "welded", "index": index, "total": total, "name": name, "msg_count": len(messages)}
+    if not chunked:
+        yield f"data: {json.dumps({**head, 'messages': messages})}\n\n"
+        return
+    parts: List[str] = []
+    size = 0
+    seq = 0
+    for msg in messages:
+        encoded = json.dumps(msg)
+        if parts and size + len(encoded) > SSE_CHUNK_BYTES:
+            yield f'data: {{"status": "chunk", "index": {index}, "seq": {seq}, "messages": [{", ".join(parts)}]}}\n\n'
+            seq += 1
+            parts, size = [], 0
+        parts.append(encoded)
+        size += len(encoded)
+    if seq == 0:
+        yield f'data: {json.dumps(head)[:-1]}, "messages": [{", ".join(parts)}]}}\n\n'
+        return
+    if parts:
+        yield f'data: {{"status": "chunk", "index": {index}, "seq": {seq}, "messages": [{", ".join(parts)}]}}\n\n'
+        seq += 1
+    yield f"data: {json.dumps({**head, 'messages': [], 'chunks': seq})}\n\n"
+
+def start_trace(endpoint: str, request: Request) -> RequestTrace:
+    return RequestTrace(endpoint, TRACE_REQUESTS or request.headers.get("x-washhouse-trace") == "1")
+
+def metered_zip(body: Iterable[bytes], trace: RequestTrace) -> Iterator[bytes]:
+    """Count bytes on the wire and hold the in-flight gauge while the zip streams."""
+    INFLIGHT.inc(endpoint=trace.endpoint)
+    sent = 0
+    status = "aborted"
+    try:
+        with trace.span("zip") as span:
+            for chunk in body:
+                sent += len(chunk)
+                yield chunk
+            span["bytes"] = sent
+        status = "ok"
+    finally:
+        BYTES_SENT.inc(sent, endpoint=trace.endpoint)
+        INFLIGHT.dec(endpoint=trace.endpoint)
+        trace.finish(status, bytes_sent=sent)
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no"
+}
+
+async def job_events(job: Job, last_event_id: int, endpoint: str):
+    """SSE body for one listener: replays the job's frames after last_event_id, then follows it live.
+
+    A listener leaving only stops this stream; the job keeps running for the next attach.
+    """
+    INFLIGHT.inc(endpoint=endpoint)
+    sent = 0
+    delivered = last_event_id
+    log_event("job_attached", job_id=job.job_id, last_event_id=last_event_id, status=job.status)
+    try:
+        async for event_id, frame in job.attach(last_event_id):
+            if event_id is not None:
+                frame = f"id: {event_id}\n{frame}"
+            sent += len(frame)
+            yield frame
+            if event_id is not None:
+                delivered = event_id
+    finally:
+        BYTES_SENT.inc(sent, endpoint=endpoint)
+        INFLIGHT.dec(endpoint=endpoint)
+        log_event("job_detached", job_id=job.job_id, delivered=delivered, events=job.events, status=job.status)
+
 # --- ENDPOINTS ---
 
 @app.get("/config")
@@ -193,91 +732,101 @@ async def get_config():
     """Expose the site personality to the frontend for UI skinning."""
     return {"personality": SITE_PERSONALITY}
 
+@app.get("/metrics")
+async def metrics(request: Request):
+    """Prometheus text exposition of stage latencies, throughput and loop lag."""
+    if not METRICS_PUBLIC:
+        if not METRICS_TOKEN:
+            raise HTTPException(status_code=404, detail="METRICS_DISABLED")
+        supplied = request.headers.get("authorization", "").encode("utf-8")
+        if not hmac.compare_digest(supplied, f"Bearer {METRICS_TOKEN}".encode("utf-8")):
+            raise HTTPException(status_code=401, detail="METRICS_TOKEN_REQUIRED", headers={"WWW-Authenticate": "Bearer"})
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/search")
+def search(q: str, session_id: Optional[str] = None, limit: int = 20):
+    """Ranked conversations + message snippets from the FTS index.
+
+    Scoped to one upload session; SIPHON may omit session_id to search the whole archive.
+    """
+    if SEARCH is None:
+        raise HTTPException(status_code=404, detail="SEARCH_DISABLED")
+    if not session_id and SITE_PERSONALITY != "SIPHON":
+        raise HTTPException(status_code=400, detail="SESSION_REQUIRED")
+    started = time.perf_counter()
+    results = SEARCH.search(session_id, q, max(1, min(limit, 100)))
+    took = time.perf_counter() - started
+    STAGE_SECONDS.observe(took, stage="search")
+    return {"query": q, "took_ms": round(took * 1000, 3), "results": results}
+
+@app.get("/sessions/stats")
+async def session_stats():
+    """Parsed upload cache occupancy and hit/miss counters."""
+    return SESSION_CACHE.stats()
+
 @app.post("/refine-stream")
-async def refine_stream(request: Request, files: List[UploadFile] = File(...), options_json: str = Form(...), start_index: int = Form(0)):
+async def refine_stream(request: Request, files: Optional[List[UploadFile]] = File(None), options_json: str = Form(...), start_index: int = Form(0), session_id: Optional[str] = Form(None)):
+    trace = start_trace("refine-stream", request)
     try:
-        options = RefineryOptions(**json.loads(options_json))
+        options = RefineryOptions.from_form(options_json)
+        uploads = detach_uploads(files)
         
-        all_chats = []
-        brand_name = "Unknown"
-        brand_handler = None
-
-        # 1. INGEST & PARSE (Multi-File Support)
-        for file in files:
-            content = await file.read()
-            
-            # THE SIPHON: Immediate archival
-            if SITE_PERSONALITY == "SIPHON":
-                os.makedirs("vault/raw", exist_ok=True)
-                timestamp = int(time.time())
-                filename = f"vault/raw/{timestamp}_{file.filename or 'unknown'}"
-                with open(filename, "wb") as f:
-                    f.write(content)
+        # Refused before the upload is parsed; submit() re-checks
+        if JOBS.full:
+            raise HTTPException(status_code=429, detail="TOO_MANY_JOBS")
 
-            try:
-                # Try parsing as JSON (even if no extension)
-                # Robust decoding: replace invalid UTF-8 bytes to prevent crash
-                decoded_content = content.decode('utf-8', errors='replace')
-                if '' in decoded_content:
-                    print(f"WARN: Invalid UTF-8 detected in {file.filename}, characters replaced.")
-                raw_data = json.loads(decoded_content)
-                
-                # Identify & Aggregate
-                if isinstance(raw_data, list) and len(raw_data) > 0 and "mapping" in raw_data[0]:
-                    # ChatGPT: It's a list of conversations
-                    all_chats.extend(raw_data)
-                    brand_name = "ChatGPT"
-                    brand_handler = handle_chatgpt
-                elif isinstance(raw_data, list) and len(raw_data) > 0 and "chat_messages" in raw_data[0]:
-                    # Claude: List of conversations
-                    all_chats.extend(raw_data)
-                    brand_name = "Claude"
-                    brand_handler = handle_claude
-                elif isinstance(raw_data, dict) and "chunkedPrompt" in raw_data:
-                    # Gemini: Single conversation per file
-                    # We treat the file dict as one "chat item"
-                    # Add a title if missing for UI niceness
-                    if "title" not in raw_data:
-                        raw_data["title"] = file.filename or "Gemini Chat"
-                    all_chats.append(raw_data)
-                    brand_name = "Gemini"
-                    brand_handler = handle_gemini
-            except json.JSONDecodeError:
-                print(f"WARN: Failed to parse file {file.filename}")
-                continue
-
-        if not all_chats:
-             # Yield error but don't crash connection immediately so UI can handle it
-            async def error_gen():
-                yield f"data: {json.dumps({'status': 'error', 'message': 'NO_VALID_PAYLOAD_FOUND'})}\n\n"
-            return StreamingResponse(error_gen(), media_type="text/event-stream")
+        # 1. INGEST (Multi-File Support)
+        # THE SIPHON: Immediate archival (queued; hashing and writes happen in the background)
+        if SITE_PERSONALITY == "SIPHON":
+            for upload_name, raw in uploads:
+                VAULT.archive_upload("raw", upload_name or "unknown", raw)
 
-        # 2. BATCHING
-        # We process a slice of all_chats based on start_index
-        # Default batch size is 20
-        batch = all_chats[start_index : start_index + 20]
+        # 2. SESSION LOOKUP
+        # A cache hit (by session_id or identical re-upload) skips the parse entirely
+        # 3. BATCHING
+        # Uncached uploads stream off the wire one conversation at a time; only
+        # the requested batch is ever held. Batches are cut by estimated cost
+        with trace.span("ingest", files=len(uploads)) as span:
+            identity = await identify_upload(uploads, session_id)
+            session, conversations = await open_session(uploads, identity, options.conversation_filter())
+            session_id = session.session_id if session else None
+            batch_iter, batches = select_batch(session, conversations, start_index)
+            # An uncached batch is parsed as it is pulled off the upload
+            batch = await run_in_threadpool(list, batch_iter)
+            span["cached"] = session is not None
         total_in_batch = len(batch)
-        
+
         if total_in_batch == 0:
-             async def empty_gen():
-                yield f"data: {json.dumps({'status': 'error', 'message': 'BATCH_EMPTY'})}\n\n"
-             return StreamingResponse(empty_gen(), media_type="text/event-stream")
+            # Yield error but don't crash connection immediately so UI can handle it
+            if conversations is None:
+                reason = "SESSION_EXPIRED"
+            else:
+                reason = "NO_VALID_PAYLOAD_FOUND" if start_index == 0 else "BATCH_EMPTY"
+            trace.finish(reason)
+            async def error_gen():
+                yield f"data: {json.dumps({'status': 'error', 'message': reason})}\n\n"
+            return StreamingResponse(error_gen(), media_type="text/event-stream")
 
-        async def event_generator():
-            print(f"DEBUG: STARTING_STREAM | BRAND={brand_name} | COUNT={total_in_batch}")
+        async def refine_job(job: Job):
+            brands = sorted({brand for brand, _ in batch})
+            log_event("stream_start", trace_id=trace.trace_id, job_id=job.job_id, brands=brands, count=total_in_batch, start_index=start_index)
             
             # Prepare names for the UI list
             batch_names = []
-            for idx, item in enumerate(batch):
+            for idx, (brand, item) in enumerate(batch):
                 # safe name retrieval
-                name = item.get("title") or item.get("name") or f"{brand_name}_Chat_{start_index + idx + 1}"
-                batch_names.append(name)
+                batch_names.append(display_name(brand, item, start_index + idx + 1))
 
-            yield f"data: {json.dumps({'status': 'start', 'total': total_in_batch, 'batch_names': batch_names})}\n\n"
+            available = len(session.conversations) if session else None
+            # Where the next batch starts; clients page from it, not from fixed steps
+            following = start_index + total_in_batch
+            await job.emit(f"data: {json.dumps({'status': 'start', 'total': total_in_batch, 'batch_names': batch_names, 'session_id': session_id, 'available': available, 'batches': batches, 'next_index': following, 'job_id': job.job_id})}\n\n")
             
-            # 3. THE REVENUE ENGINE (STRICT TIMING)
+            # 4. THE REVENUE ENGINE (STRICT TIMING)
             # Formula: TotalWaitSeconds = 60 + (N - 1) * (240 / 19)
             # If N=1 -> 60s. If N=20 -> 300s.
+            # The job pays it, so reconnecting never skips (or restarts) the toll
+            total_wait_seconds = 0
             if SITE_PERSONALITY == "TOLL":
                 if total_in_batch > 1:
                      total_wait_seconds = 60 + (total_in_batch - 1) * (240 / 19)
@@ -288,123 +837,241 @@ async def refine_stream(request: Request, files: List[UploadFile] = File(...), o
             else:
                 delay_per_chat = 0 # Siphon is instant
 
-            print(f"REVENUE_LOGIC: N={total_in_batch} | TOTAL_WAIT={total_wait_seconds}s | DELAY_PER={delay_per_chat}s")
-
-            for idx, item in enumerate(batch):
-                # Check connection
-                if await request.is_disconnected():
-                    print("STRIKE_SEVERED: Client disconnected.")
-                    break
+            log_event("toll", trace_id=trace.trace_id, n=total_in_batch, total_wait_seconds=total_wait_seconds, delay_per_chat=delay_per_chat)
 
-                # PAY THE TOLL
-                # We wait BEFORE yielding the result to enforce the "Processing..." state retention
-                await asyncio.sleep(delay_per_chat)
-                
-                # Process
-                messages = brand_handler(item, options, raw=True)
-                item_name = batch_names[idx]
-                
-                yield f"data: {json.dumps({'status': 'welded', 'index': idx + 1, 'total': total_in_batch, 'name': item_name, 'messages': messages, 'msg_count': len(messages)})}\n\n"
+            # Refinement runs on the worker pool; results come back in batch order
+            refined = REFINE_EXECUTOR.amap_ordered(
+                refine_conversation, ((brand, item, options, True) for brand, item in batch)
+            )
+            produced = 0
+            status = "aborted"
+            # Welded conversations for the search index (needs a session to key them by)
+            ledger: Optional[List[Dict[str, Any]]] = [] if SEARCH is not None and session_id else None
+            try:
+                for idx in range(total_in_batch):
+                    # PAY THE TOLL
+                    # We wait BEFORE emitting the result to enforce the "Processing..." state retention
+                    with trace.span("toll"):
+                        await asyncio.sleep(delay_per_chat)
+                    
+                    # Process (the wait covers whatever refinement is still running)
+                    with trace.span("refine_wait"):
+                        async with JOBS.slot():
+                            messages = await anext(refined)
+                    item_name = batch_names[idx]
+                    CONVERSATIONS.inc(brand=batch[idx][0])
+                    MESSAGES.inc(len(messages), brand=batch[idx][0])
+                    if ledger is not None:
+                        ledger.append({"position": start_index + idx, "title": item_name, "brand": batch[idx][0], "messages": messages})
+                    
+                    frames = welded_events(idx + 1, total_in_batch, item_name, messages, options.message_chunks)
+                    while True:
+                        started = time.perf_counter()
+                        event = next(frames, None)
+                        if event is None:
+                            break
+                        trace.record("sse_serialize", time.perf_counter() - started, index=idx + 1, bytes=len(event))
+                        produced += len(event)
+                        await job.emit(event)
+                status = "ok"
+            except Exception as e:
+                # Listeners (and late re-attaches) get a terminal frame instead of a silent cut
+                status = "error"
+                await job.emit(f"data: {json.dumps({'status': 'error', 'message': str(e)})}\n\n")
+                raise
+            finally:
+                await refined.aclose()
+                if ledger:
+                    SEARCH.add(session_id, ledger)
+                trace.finish(status, job_id=job.job_id, bytes_produced=produced, conversations=total_in_batch)
             
-            yield f"data: {json.dumps({'status': 'complete'})}\n\n"
+            await job.emit(f"data: {json.dumps({'status': 'complete'})}\n\n")
 
+        # The batch now belongs to the job; this response is just its first listener
+        try:
+            job = JOBS.submit(refine_job)
+        except JobsFull:
+            raise HTTPException(status_code=429, detail="TOO_MANY_JOBS")
         return StreamingResponse(
-            event_generator(),
+            job_events(job, -1, trace.endpoint),
             media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "X-Accel-Buffering": "no"
-            }
+            headers={**SSE_HEADERS, "X-Washhouse-Job": job.job_id},
         )
+    except HTTPException as e:
+        trace.finish(str(e.status_code))
+        raise
     except Exception as e:
-        print(f"DEBUG: REFINE_STREAM_CRITICAL_FAIL: {e}")
+        log_event("refine_stream_failed", trace_id=trace.trace_id, error=str(e))
+        trace.finish("error")
         raise HTTPException(status_code=500, detail=str(e))
 
+def artifact_response(request: Request, artifact, headers: Dict[str, str]) -> Response:
+    """A stored zip: 304 on a matching If-None-Match, else the file (Range / If-Range aware)."""
+    if etag_matches(request.headers.get("if-none-match"), artifact.etag):
+        return Response(status_code=304, headers={"ETag": artifact.etag})
+    return ArtifactResponse(artifact, media_type="application/x-zip-compressed", headers=headers)
+
+@app.get("/artifacts/{key}")
+async def download_artifact(request: Request, key: str):
+    """Re-download (or resume, with Range) a stored /refine zip by its X-Washhouse-Artifact key."""
+    if ARTIFACTS is None:
+        raise HTTPException(status_code=404, detail="ARTIFACTS_DISABLED")
+    artifact = ARTIFACTS.get(key)
+    if artifact is None:
+        raise HTTPException(status_code=404, detail="ARTIFACT_NOT_FOUND")
+    zip_filename = "ULTRADATA_STRIKE_EXTRACT.zip" if SITE_PERSONALITY == "TOLL" else "refined_chat_export.zip"
+    return artifact_response(request, artifact, {"Content-Disposition": f"attachment; filename={zip_filename}", "X-Washhouse-Artifact": key})
+
+def find_job(job_id: str) -> Job:
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="JOB_NOT_FOUND")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """Status and event count of a refine job (queued, running, done, failed, cancelled)."""
+    return find_job(job_id).summary()
+
+@app.get("/jobs/{job_id}/events")
+async def job_stream(request: Request, job_id: str, last_event_id: Optional[int] = None):
+    """Re-attach to a refine job's SSE stream.
+
+    Frames after the Last-Event-ID header (or ?last_event_id=) are replayed, then
+    the stream follows the job live; without either, the job replays from the start.
+    """
+    job = find_job(job_id)
+    header = request.headers.get("last-event-id")
+    if header is not None:
+        try:
+            last_event_id = int(header)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="BAD_LAST_EVENT_ID")
+    # Only ids the job has handed out (or -1, from the start) can be resumed after
+    if last_event_id is not None and not -1 <= last_event_id < job.events:
+        raise HTTPException(status_code=400, detail="BAD_LAST_EVENT_ID")
+    return StreamingResponse(
+        job_events(job, -1 if last_event_id is None else last_event_id, "job-events"),
+        media_type="text/event-stream",
+        headers={**SSE_HEADERS, "X-Washhouse-Job": job.job_id},
+    )
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Stop a queued or running job; its frames so far stay replayable until retention expires."""
+    job = find_job(job_id)
+    return {"job_id": job.job_id, "cancelled": JOBS.cancel(job_id)}
+
 @app.post("/refine")
-async def refine_payload(files: List[UploadFile] = File(...), options_json: str = Form(...), start_index: int = Form(0)):
+async def refine_payload(request: Request, files: Optional[List[UploadFile]] = File(None), options_json: str = Form(...), start_index: int = Form(0), session_id: Optional[str] = Form(None)):
+    trace = start_trace("refine", request)
     try:
-        options = RefineryOptions(**json.loads(options_json))
+        options = RefineryOptions.from_form(options_json)
         
-        all_chats = []
-        brand_name = "Unknown"
-        brand_handler = None
 
-        # 1. AGGREGATE
-        for file in files:
-            content = await file.read()
-            try:
-                # Robust decoding: replace invalid UTF-8 bytes to prevent crash
-                decoded_content = content.decode('utf-8', errors='replace')
-                if '' in decoded_content:
-                    print(f"WARN: Invalid UTF-8 detected in {file.filename}, characters replaced.")
-                raw_data = json.loads(decoded_content)
-                if isinstance(raw_data, list) and len(raw_data) > 0 and "mapping" in raw_data[0]:
-                    all_chats.extend(raw_data)
-                    brand_handler = handle_chatgpt
-                    brand_name = "ChatGPT"
-                elif isinstance(raw_data, list) and len(raw_data) > 0 and "chat_messages" in raw_data[0]:
-                    all_chats.extend(raw_data)
-                    brand_handler = handle_claude
-                    brand_name = "Claude"
-                elif isinstance(raw_data, dict) and "chunkedPrompt" in raw_data:
-                    if "title" not in raw_data:
-                        raw_data["title"] = file.filename or "Gemini Chat"
-                    all_chats.append(raw_data)
-                    brand_handler = handle_gemini
-                    brand_name = "Gemini"
-            except:
-                 continue
-
-        if not all_chats:
+        # ZIP EXPORT: Static Naming based on Identity
+        zip_filename = "ULTRADATA_STRIKE_EXTRACT.zip" if SITE_PERSONALITY == "TOLL" else "refined_chat_export.zip"
+        headers = {"Content-Disposition": f"attachment; filename={zip_filename}"}
+        conv_filter = options.conversation_filter()
+        uploads = detach_uploads(files)
+
+        # THE WAREHOUSE: the same batch of the same upload with the same options
+        # is served from disk. A batch is fixed by the content hash, filter,
+        # start and batch rule, so the lookup runs before anything is parsed
+        # (an expired or uncacheable session costs a hash, not a re-parse)
+        artifact = None
+        with trace.span("identify") as span:
+            identity = await identify_upload(uploads, session_id)
+            span["cached"] = identity[0] is not None
+        content_id = identity[1]
+        if ARTIFACTS is not None and content_id is not None:
+            scoped_id = scoped_session_id(content_id, conv_filter.scope() if conv_filter else None)
+            key = ARTIFACTS.key(
+                scoped_id, (start_index, BATCH_BUDGET, BATCH_MAX),
+                {**options.render_key(), "zip_profile": options.archive_profile()},
+            )
+            headers["X-Washhouse-Artifact"] = key
+            stored = ARTIFACTS.get(key)
+            if stored is not None:
+                for _, raw in uploads:
+                    raw.close()
+                # A hit answers like the build did, so API clients keep paging
+                if "next_index" in stored.meta:
+                    headers["X-Washhouse-Next-Index"] = str(stored.meta["next_index"])
+                if scoped_id in SESSION_CACHE:
+                    headers["X-Washhouse-Session"] = scoped_id
+                trace.finish("artifact_hit", artifact=key)
+                return artifact_response(request, stored, headers)
+            artifact = ARTIFACTS.new_build(key)
+            headers["ETag"] = artifact.etag
+
+        # 1. INGEST & BATCH
+        # Cached sessions skip the parse; otherwise conversations come straight
+        # off the upload stream
+        with trace.span("ingest") as span:
+            session, conversations = await open_session(uploads, identity, conv_filter)
+            session_id = session.session_id if session else None
+            span["cached"] = session is not None
+        if conversations is None:
+            raise HTTPException(status_code=410, detail="SESSION_EXPIRED")
+
+        # Held whole (at most BATCH_MAX chats) so a streamed upload can report where it ended
+        batch_iter, _ = select_batch(session, conversations, start_index)
+        batch = await run_in_threadpool(list, batch_iter)
+        if not batch and start_index == 0:
              raise HTTPException(status_code=400, detail="NO_VALID_PAYLOAD")
+        headers["X-Washhouse-Next-Index"] = str(start_index + len(batch))
+        if artifact is not None:
+            artifact.meta["next_index"] = start_index + len(batch)
+        if session_id:
+            headers["X-Washhouse-Session"] = session_id
 
-        refined_files = []
-        
-        # 2. BATCH
-        batch = all_chats[start_index : start_index + 20]
-        
-        # 3. PROCESS
-        for idx, item in enumerate(batch):
-            # SAFE NAME GENERATION
-            # If default name logic fails, use generic
-            base_name = item.get("title") or item.get("name") or f"{brand_name}_Chat_{start_index + idx + 1}"
-            safe_name = clean_filename(base_name) # Ensure usage of clean_filename helper if available or simple replace
-            
-            # Since helper availability isn't guaranteed in this snippet scope, let's use robust local logic
-            safe_name = re.sub(r'[\s]+', '.', safe_name)
-            safe_name = re.sub(r'[^a-zA-Z0-9.-]', '', safe_name)
-            
-            refined_content = brand_handler(item, options)
-            refined_files.append({"name": safe_name, "content": refined_content})
+        # 2. PROCESS (lazily: conversations fan out to the worker pool as the zip pulls them)
+        def refined_entries():
+            slots = deque()  # (brand, cache key, cache hit) per queued job
+            render_key = options.render_key()
+            def jobs():
+                for idx, (brand, item) in enumerate(batch):
+                    title = display_name(brand, item, start_index + idx + 1)
+                    key = RENDER_CACHE.key(brand, item, title, render_key) if RENDER_CACHE else None
+                    cached = RENDER_CACHE.get(key) if key else None
+                    slots.append((brand, key, cached is not None))
+                    # Unchanged chats skip the worker pool entirely
+                    yield REFINE_EXECUTOR.resolved(cached) if cached is not None else (title, brand, item, options)
+            for entries in REFINE_EXECUTOR.map_ordered(refine_entries, jobs()):
+                brand, key, hit = slots.popleft()
+                CONVERSATIONS.inc(brand=brand)
+                if key and not hit:
+                    RENDER_CACHE.put(key, entries)
+                yield from entries
 
-        zip_io = io.BytesIO()
-        
-        # ZIP EXPORT: Static Naming based on Identity
-        zip_filename = "ULTRADATA_STRIKE_EXTRACT.zip" if SITE_PERSONALITY == "TOLL" else "refined_chat_export.zip"
-        
-        with zipfile.ZipFile(zip_io, mode='w', compression=zipfile.ZIP_DEFLATED) as temp_zip:
-            for file_info in refined_files:
-                temp_zip.writestr(f"{file_info['name']}.md", file_info['content'])
-        
-        zip_io.seek(0)
+        # 3. STREAM: every entry goes out on the wire as soon as it is compressed
+        # The vault dedups by content hash, so its copy must not carry the wall clock:
+        # the same batch refined twice is then the same bytes and stored once
+        siphoned = SITE_PERSONALITY == "SIPHON"
+        body = stream_zip(
+            refined_entries(), options.archive_profile(), ZIP_EXECUTOR, ZIP_WORKERS,
+            ZIP_EPOCH if siphoned else None,
+        )
         
-        # THE SIPHON: Archive the final refined output
-        if SITE_PERSONALITY == "SIPHON":
-            os.makedirs("vault/refined", exist_ok=True)
-            archive_path = f"vault/refined/{int(time.time())}_{zip_filename}"
-            with open(archive_path, "wb") as f:
-                f.write(zip_io.getvalue())
-            print(f"SIPHON_EXPORT: Persisted refined artifact to {archive_path}")
-            zip_io.seek(0) # Reset after writing
+        # THE SIPHON: Archive the final refined output (teed off the same chunks)
+        if siphoned:
+            body = VAULT.tee(body, "refined", zip_filename)
+        if artifact is not None:
+            body = ARTIFACTS.record(artifact, body)
+        body = metered_zip(body, trace)
 
         return StreamingResponse(
-            iter([zip_io.getvalue()]),
+            body,
             media_type="application/x-zip-compressed",
-            headers={"Content-Disposition": f"attachment; filename={zip_filename}"}
+            headers=headers
         )
+    except HTTPException as e:
+        trace.finish(str(e.status_code))
+        raise
     except Exception as e:
-        print(f"REFINE_ERROR: {e}")
+        log_event("refine_failed", trace_id=trace.trace_id, error=str(e))
+        trace.finish("error")
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
@@ -0,0 +1,239 @@
+import asyncio
+import json
+import logging
+import math
+import sys
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# THE GAUGES: INSTRUMENTATION
+# Dependency-free Prometheus text exposition plus structured JSON event logs.
+# Counters, gauges and histograms are thread-safe: refinement and zip streams
+# run on worker threads, not on the event loop.
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def _labels(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _fmt_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_fmt_labels(k)} {_fmt_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, collect: Optional[Callable[[], Dict[LabelKey, float]]] = None):
+        super().__init__(name, help_text)
+        self._values: Dict[LabelKey, float] = {}
+        self._collect = collect
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_labels(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = dict(self._values)
+        if self._collect:
+            items.update(self._collect())
+        return self.header() + [f"{self.name}{_fmt_labels(k)} {_fmt_value(v)}" for k, v in items.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._series: Dict[LabelKey, List[float]] = {}  # bucket counts..., sum, count
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            series[bisect_left(self.buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        lines = self.header()
+        for key, series in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_fmt_labels(key, ('le', _fmt_value(bound)))} {_fmt_value(cumulative)}")
+            lines.append(f"{self.name}_sum{_fmt_labels(key)} {_fmt_value(series[-2])}")
+            lines.append(f"{self.name}_count{_fmt_labels(key)} {_fmt_value(series[-1])}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> Any:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self.register(Counter(name, help_text))
+
+    def gauge(self, name: str, help_text: str, collect: Optional[Callable[[], Dict[LabelKey, float]]] = None) -> Gauge:
+        return self.register(Gauge(name, help_text, collect))
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram("washhouse_stage_seconds", "Latency of each refinery stage.")
+BYTES_INGESTED = REGISTRY.counter("washhouse_bytes_ingested_total", "Raw upload bytes received.")
+BYTES_SENT = REGISTRY.counter("washhouse_bytes_sent_total", "Response payload bytes produced.")
+CONVERSATIONS = REGISTRY.counter("washhouse_conversations_total", "Conversations refined.")
+MESSAGES = REGISTRY.counter("washhouse_messages_total", "Refined messages emitted.")
+REQUESTS = REGISTRY.counter("washhouse_requests_total", "Refinery requests by endpoint and outcome.")
+INFLIGHT = REGISTRY.gauge("washhouse_inflight_streams", "Response streams currently open.")
+LOOP_LAG = REGISTRY.histogram(
+    "washhouse_event_loop_lag_seconds",
+    "Scheduling delay of a periodic event-loop probe.",
+    (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+LOOP_LAG_LAST = REGISTRY.gauge("washhouse_event_loop_lag_last_seconds", "Most recent event-loop lag sample.")
+
+# --- STRUCTURED EVENTS ---
+
+LOGGER = logging.getLogger("washhouse")
+if not LOGGER.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    LOGGER.addHandler(_handler)
+    LOGGER.setLevel(logging.INFO)
+    LOGGER.propagate = False
+
+
+def log_event(event: str, **fields):
+    LOGGER.info(json.dumps({"ts": round(time.time(), 3), "event": event, **fields}, default=str))
+
+
+class RequestTrace:
+    """Per-request span log. Every span also feeds the stage histogram;
+    the trace itself is only emitted when enabled for the request."""
+
+    def __init__(self, endpoint: str, enabled: bool = False):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.endpoint = endpoint
+        self.enabled = enabled
+        self.started = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float, **fields):
+        STAGE_SECONDS.observe(seconds, stage=stage)
+        if self.enabled:
+            with self._lock:
+                self.spans.append({"stage": stage, "ms": round(seconds * 1000, 3), **fields})
+
+    @contextmanager
+    def span(self, stage: str, **fields) -> Iterator[Dict[str, Any]]:
+        start = time.perf_counter()
+        try:
+            yield fields
+        finally:
+            self.record(stage, time.perf_counter() - start, **fields)
+
+    def finish(self, status: str, **fields):
+        REQUESTS.inc(endpoint=self.endpoint, status=status)
+        if self.enabled:
+            log_event(
+                "trace",
+                trace_id=self.trace_id,
+                endpoint=self.endpoint,
+                status=status,
+                total_ms=round((time.perf_counter() - self.started) * 1000, 3),
+                spans=self.spans,
+                **fields,
+            )
+
+
+# --- EVENT LOOP LAG ---
+
+async def monitor_event_loop(interval: float = 0.5):
+    """Sleep for `interval` and measure how late the loop wakes us up."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        LOOP_LAG.observe(lag)
+        LOOP_LAG_LAST.set(lag)
@@ -0,0 +1,85 @@
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+# THE DISPATCHER: COST-BASED BATCHING
+# A batch used to be a flat 20 conversations, so twenty one-liners and twenty
+# 10 MB coding sessions cost the same request. Each conversation is now priced
+# by its text volume plus a per-message overhead, and batches are cut greedily
+# at a work budget (never more than max_items, never fewer than one chat).
+# The same cut is used for the full plan (cached sessions) and on the fly
+# (streamed uploads), so a batch boundary means the same thing on both paths.
+
+MESSAGE_OVERHEAD = 256  # headers, merge bookkeeping and JSON framing per message
+
+Conversation = Tuple[str, Dict[str, Any]]
+
+
+def _chatgpt_cost(conv: Dict[str, Any]) -> Tuple[int, int]:
+    messages, size = 0, 0
+    for node in (conv.get("mapping") or {}).values():
+        message = node.get("message") if isinstance(node, dict) else None
+        if not message:
+            continue
+        messages += 1
+        for part in (message.get("content") or {}).get("parts") or []:
+            if isinstance(part, str):
+                size += len(part)
+    return messages, size
+
+
+def _claude_cost(chat: Dict[str, Any]) -> Tuple[int, int]:
+    messages, size = 0, 0
+    for message in chat.get("chat_messages") or []:
+        messages += 1
+        content = sum(len(c.get("text") or "") for c in message.get("content") or [] if isinstance(c, dict))
+        size += content or len(message.get("text") or "")
+    return messages, size
+
+
+def _gemini_cost(data: Dict[str, Any]) -> Tuple[int, int]:
+    messages, size = 0, 0
+    for chunk in (data.get("chunkedPrompt") or {}).get("chunks") or []:
+        messages += 1
+        size += len(chunk.get("text") or "")
+        size += sum(len(p.get("text") or "") for p in chunk.get("parts") or [] if isinstance(p, dict))
+    return messages, size
+
+
+COST_ESTIMATORS = {
+    "ChatGPT": _chatgpt_cost,
+    "Claude": _claude_cost,
+    "Gemini": _gemini_cost,
+}
+
+
+def conversation_cost(brand: str, item: Dict[str, Any]) -> int:
+    estimator = COST_ESTIMATORS.get(brand)
+    if estimator is None:
+        return MESSAGE_OVERHEAD
+    messages, size = estimator(item)
+    return max(1, size + messages * MESSAGE_OVERHEAD)
+
+
+def plan_batches(costs: List[int], budget: int, max_items: int) -> List[Tuple[int, int]]:
+    """Greedy [start, end) boundaries over per-conversation costs."""
+    batches: List[Tuple[int, int]] = []
+    start, spent = 0, 0
+    for idx, cost in enumerate(costs):
+        if idx > start and (idx - start >= max_items or spent + cost > budget):
+            batches.append((start, idx))
+            start, spent = idx, 0
+        spent += cost
+    if start < len(costs):
+        batches.append((start, len(costs)))
+    return batches
+
+
+def take_batch(conversations: Iterable[Conversation], budget: int, max_items: int) -> Iterator[Conversation]:
+    """Lazily cut the next batch off a conversation stream (same rule as plan_batches)."""
+    spent = 0
+    for count, (brand, item) in enumerate(islice(conversations, max_items)):
+        cost = conversation_cost(brand, item)
+        if count and spent + cost > budget:
+            return
+        spent += cost
+        yield brand, item
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from metrics import log_event
+
+# THE MEMORY: INCREMENTAL RE-IMPORT
+# Re-exports are supersets of the last one. Rendered entries are cached on
+# disk per conversation, keyed by (fingerprint, refinery options, title), so
+# /refine only refines chats that are new or changed since the last export.
+#
+#   fingerprint   brand + id + update time when the export carries them,
+#                 otherwise a hash of the conversation's canonical JSON
+#   salt          digest of the render assets; new ASCII art invalidates everything
+#
+# Layout: <root>/<key[:2]>/<key>.json, pruned oldest-first past max_bytes.
+
+Entries = List[Tuple[str, List[str]]]
+
+# (id field, update time field) per brand
+VERSION_FIELDS = {
+    "ChatGPT": (("id", "conversation_id"), "update_time"),
+    "Claude": (("uuid",), "updated_at"),
+}
+
+PRUNE_EVERY = 64
+
+
+def fingerprint(brand: str, item: Dict[str, Any]) -> str:
+    id_fields, time_field = VERSION_FIELDS.get(brand, ((), None))
+    conv_id = next((item[f] for f in id_fields if item.get(f)), None)
+    version = item.get(time_field) if time_field else None
+    if conv_id is not None and version is not None:
+        return f"{brand}:{conv_id}:{version}"
+    canonical = json.dumps(item, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return f"{brand}:sha256:{hashlib.sha256(canonical.encode('utf-8')).hexdigest()}"
+
+
+class RenderCache:
+    def __init__(self, root: str = "render_cache", max_bytes: int = 1024 * 1024 * 1024, salt: str = ""):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.salt = salt
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="render-cache")
+
+    def key(self, brand: str, item: Dict[str, Any], title: str, options: Dict[str, Any]) -> str:
+        material = json.dumps([self.salt, fingerprint(brand, item), title, options], sort_keys=True, default=str)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + ".json")
+
+    def get(self, key: str) -> Optional[Entries]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entries = [(name, [text]) for name, text in json.load(f)]
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            # Recency for oldest-first pruning
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return entries
+
+    def _write(self, key: str, entries: Entries):
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        staging = f"{path}.{uuid.uuid4().hex}.part"
+        with open(staging, "w", encoding="utf-8") as f:
+            json.dump([[name, "".join(chunks)] for name, chunks in entries], f, ensure_ascii=False)
+        os.replace(staging, path)
+        with self._lock:
+            self.stored += 1
+            prune = self.stored % PRUNE_EVERY == 0
+        if prune:
+            self._prune()
+
+    def _prune(self):
+        files = []
+        total = 0
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        removed = 0
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        log_event("render_cache_pruned", removed=removed, bytes=total)
+
+    def put(self, key: str, entries: Entries):
+        """Store rendered entries in the background; the response never waits on disk."""
+        future = self._writer.submit(self._write, key, entries)
+        future.add_done_callback(self._report)
+
+    @staticmethod
+    def _report(future):
+        error = future.exception()
+        if error is not None:
+            log_event("render_cache_error", error=str(error))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "stored": self.stored}
+
+    def shutdown(self):
+        self._writer.shutdown(wait=True)
@@ -0,0 +1,209 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from metrics import log_event
+
+# THE LEDGER: FULL-TEXT SEARCH OVER REFINED CONVERSATIONS
+# Refined messages are indexed into SQLite FTS5 as /refine-stream welds each
+# batch, keyed by scope (the upload session id):
+#
+#   conversations   one row per (scope, batch position): title, brand, message count
+#   messages        FTS5 over message text, ranked by the built-in bm25 rank, with snippets
+#   scopes          last write per scope; idle scopes are purged after the TTL
+#                   (ttl <= 0 keeps everything, which SIPHON uses for its archive)
+#
+# Writes go through one background thread; readers get their own connection
+# per thread (WAL mode lets them run alongside the writer).
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scopes (
+    scope TEXT PRIMARY KEY,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY,
+    scope TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    title TEXT,
+    brand TEXT,
+    msg_count INTEGER,
+    UNIQUE (scope, position)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5(
+    text,
+    scope UNINDEXED,
+    role UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+# A message's rowid is (conversation id << SEQ_BITS) | seq, so a conversation's
+# messages are one rowid range: replaced and purged without scanning the index
+SEQ_BITS = 20
+SEQ_MASK = (1 << SEQ_BITS) - 1
+
+PURGE_INTERVAL = 60.0
+TOKEN = re.compile(r"\w+\*?", re.UNICODE)
+
+
+def fts_query(text: str) -> Optional[str]:
+    """Turn free text into an FTS5 AND query; operators in user input are never interpreted."""
+    terms = []
+    for token in TOKEN.findall(text or ""):
+        prefix = token.endswith("*")
+        word = token.rstrip("*")
+        if word:
+            terms.append(f'"{word}"' + ("*" if prefix else ""))
+    return " ".join(terms) or None
+
+
+class SearchIndex:
+    def __init__(self, path: str = "search.db", ttl_seconds: float = 86400):
+        self.path = path
+        self.ttl = ttl_seconds
+        self.indexed = 0
+        self._local = threading.local()
+        self._last_purge = 0.0
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search")
+        self._ready = False
+        self._ready_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with self._ready_lock:
+                if not self._ready:
+                    conn.executescript(SCHEMA)
+                    self._ready = True
+            self._local.conn = conn
+        return conn
+
+    # --- WRITES (background thread) ---
+
+    def _conversation_id(self, conn: sqlite3.Connection, scope: str, doc: Dict[str, Any]) -> int:
+        values = (doc["title"], doc["brand"], len(doc["messages"]), scope, doc["position"])
+        row = conn.execute("SELECT id FROM conversations WHERE scope = ? AND position = ?", values[3:]).fetchone()
+        if row is None:
+            return conn.execute(
+                "INSERT INTO conversations (title, brand, msg_count, scope, position) VALUES (?, ?, ?, ?, ?)", values
+            ).lastrowid
+        # Re-refining a batch replaces its rows instead of duplicating them
+        self._drop_messages(conn, row[0])
+        conn.execute("UPDATE conversations SET title = ?, brand = ?, msg_count = ? WHERE scope = ? AND position = ?", values)
+        return row[0]
+
+    @staticmethod
+    def _drop_messages(conn: sqlite3.Connection, conversation_id: int):
+        base = conversation_id << SEQ_BITS
+        conn.execute("DELETE FROM messages WHERE rowid BETWEEN ? AND ?", (base, base | SEQ_MASK))
+
+    def _write(self, scope: str, docs: List[Dict[str, Any]]):
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            for doc in docs:
+                base = self._conversation_id(conn, scope, doc) << SEQ_BITS
+                conn.executemany(
+                    "INSERT INTO messages (rowid, text, scope, role) VALUES (?, ?, ?, ?)",
+                    [(base | seq, msg["text"], scope, msg["role"]) for seq, msg in enumerate(doc["messages"][:SEQ_MASK + 1])],
+                )
+            conn.execute("INSERT OR REPLACE INTO scopes (scope, updated_at) VALUES (?, ?)", (scope, now))
+        self.indexed += len(docs)
+        if self.ttl > 0 and now - self._last_purge > PURGE_INTERVAL:
+            self._last_purge = now
+            self._purge(conn, now - self.ttl)
+
+    def _purge(self, conn: sqlite3.Connection, cutoff: float):
+        stale = [row[0] for row in conn.execute("SELECT scope FROM scopes WHERE updated_at < ?", (cutoff,))]
+        if not stale:
+            return
+        with conn:
+            for scope in stale:
+                for (conversation_id,) in conn.execute("SELECT id FROM conversations WHERE scope = ?", (scope,)).fetchall():
+                    self._drop_messages(conn, conversation_id)
+                conn.execute("DELETE FROM conversations WHERE scope = ?", (scope,))
+                conn.execute("DELETE FROM scopes WHERE scope = ?", (scope,))
+        log_event("search_purged", scopes=len(stale))
+
+    def add(self, scope: str, docs: List[Dict[str, Any]]):
+        """Queue refined conversations for indexing: dicts of position, title, brand, messages."""
+        if not docs:
+            return
+        future = self._writer.submit(self._write, scope, docs)
+        future.add_done_callback(self._report)
+
+    @staticmethod
+    def _report(future):
+        error = future.exception()
+        if error is not None:
+            log_event("search_index_error", error=str(error))
+
+    # --- READS ---
+
+    def search(self, scope: Optional[str], text: str, limit: int = 20, snippets: int = 3) -> List[Dict[str, Any]]:
+        """Best-ranked conversations for `text`, each with its top message snippets.
+
+        scope=None searches every scope (the SIPHON archive-wide view).
+        """
+        query = fts_query(text)
+        if query is None:
+            return []
+        conn = self._connect()
+        where, params = ("messages MATCH ?", [query]) if scope is None else ("messages MATCH ? AND scope = ?", [query, scope])
+        # Over-fetch messages, then fold them into conversations in rank order
+        rows = conn.execute(
+            f"""
+            SELECT rowid, role, rank, snippet(messages, 0, '[', ']', '…', 16)
+            FROM messages
+            WHERE {where}
+            ORDER BY rank
+            LIMIT ?
+            """,
+            (*params, limit * snippets * 4),
+        ).fetchall()
+        results: Dict[int, Dict[str, Any]] = {}
+        for rowid, role, rank, snippet in rows:
+            conversation_id = rowid >> SEQ_BITS
+            hit = results.get(conversation_id)
+            if hit is None:
+                if len(results) >= limit:
+                    continue
+                hit = results[conversation_id] = {"score": round(-rank, 4), "hits": 0, "snippets": []}
+            hit["hits"] += 1
+            if len(hit["snippets"]) < snippets:
+                hit["snippets"].append({"seq": rowid & SEQ_MASK, "role": role, "snippet": snippet})
+        if results:
+            marks = ",".join("?" * len(results))
+            for conversation_id, scope_id, position, title, brand, msg_count in conn.execute(
+                f"SELECT id, scope, position, title, brand, msg_count FROM conversations WHERE id IN ({marks})", tuple(results)
+            ):
+                results[conversation_id].update(
+                    session_id=scope_id, position=position, title=title, brand=brand, msg_count=msg_count
+                )
+        return list(results.values())
+
+    def stats(self) -> Dict[str, Any]:
+        conn = self._connect()
+        scopes = conn.execute("SELECT COUNT(*) FROM scopes").fetchone()[0]
+        conversations = conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+        return {
+            "scopes": scopes,
+            "conversations": conversations,
+            "indexed": self.indexed,
+            "bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+        }
+
+    def shutdown(self):
+        # Drain queued batches before the process exits
+        self._writer.shutdown(wait=True)
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, BinaryIO, Dict, Iterable, List, Optional, Tuple
+
+from ingest import map_upload
+
+# THE HOLDING PEN: PARSED UPLOAD SESSIONS
+# /refine-stream pages through an export 20 conversations at a time. Without a
+# session every page re-uploads and re-parses the whole file. The first call
+# parses once and parks the conversations here under the upload's content hash;
+# later pages reference that id (or re-upload identical bytes) and skip ingest.
+#
+# The budget is in parsed bytes, not upload bytes: the dicts, lists and strs a
+# JSON export turns into weigh several times the file. A session's weight is
+# estimated from its upload size times parse_factor (walking the parsed
+# objects to measure them would cost more than the parse), so an upload that
+# would not fit is turned away before it is parsed.
+
+HASH_CHUNK = 1024 * 1024
+
+# Typical parsed/raw ratio of an export (small strings and per-node dicts)
+PARSE_FACTOR = 4.0
+
+
+def hash_uploads(uploads: Iterable[Tuple[Optional[str], BinaryIO]]) -> Tuple[str, int]:
+    """Content hash + total byte size across (filename, fileobj) pairs.
+
+    The filename is part of the key because Gemini titles fall back to it.
+    """
+    digest = hashlib.sha256()
+    total = 0
+    for filename, raw in uploads:
+        digest.update((filename or "").encode("utf-8") + b"\0")
+        mapped = map_upload(raw)
+        if mapped is not None:
+            # Spooled to disk: hash the mapped pages in one call, no chunk copies
+            with mapped:
+                digest.update(mapped)
+                total += len(mapped)
+            digest.update(b"\0")
+            continue
+        raw.seek(0)
+        while True:
+            chunk = raw.read(HASH_CHUNK)
+            if not chunk:
+                break
+            total += len(chunk)
+            digest.update(chunk)
+        digest.update(b"\0")
+        raw.seek(0)
+    return digest.hexdigest()[:32], total
+
+
+def scoped_session_id(content_id: str, scope: Optional[Dict[str, Any]]) -> str:
+    """Session id for a parse of content_id narrowed by a filter scope; the content hash itself when unfiltered."""
+    if scope is None:
+        return content_id
+    material = json.dumps([content_id, scope], sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()[:32]
+
+
+class UploadSession:
+    def __init__(
+        self,
+        session_id: str,
+        conversations: List[Tuple[str, Dict[str, Any]]],
+        size: int,
+        content_id: Optional[str] = None,
+        scope: Optional[Dict[str, Any]] = None,
+        memory: Optional[int] = None,
+    ):
+        self.session_id = session_id
+        self.conversations = conversations
+        # Upload bytes it was parsed from, and the estimated memory the parse holds
+        self.size = size
+        self.memory = size if memory is None else memory
+        # The upload it was parsed from and the filter it was parsed through (None: everything)
+        self.content_id = content_id or session_id
+        self.scope = scope
+        # Batch boundaries, planned once, off the event loop, when the session is built
+        self.batches: Optional[List[Tuple[int, int]]] = None
+        self.created = time.monotonic()
+        self.last_access = self.created
+
+
+class SessionCache:
+    """LRU + TTL cache of parsed uploads, bounded by their estimated memory."""
+
+    def __init__(self, max_bytes: int, max_sessions: int, ttl_seconds: float, parse_factor: float = PARSE_FACTOR):
+        self.max_bytes = max_bytes
+        self.parse_factor = parse_factor
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, UploadSession]" = OrderedDict()
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejected = 0
+
+    def _drop(self, session_id: str):
+        session = self._entries.pop(session_id)
+        self.bytes_used -= session.memory
+
+    def _expire(self):
+        now = time.monotonic()
+        stale = [sid for sid, s in self._entries.items() if now - s.last_access > self.ttl_seconds]
+        for sid in stale:
+            self._drop(sid)
+            self.evictions += 1
+
+    def admits(self, size: int) -> bool:
+        return 0 < size <= self.max_bytes
+
+    def estimate(self, size: int) -> int:
+        """Memory a parse of size upload bytes is expected to hold."""
+        return int(size * self.parse_factor)
+
+    def admits_upload(self, size: int) -> bool:
+        """Whether an upload of this many bytes is worth parsing into a session."""
+        return self.admits(self.estimate(size))
+
+    def __contains__(self, session_id: str) -> bool:
+        """Whether the session is cached, without touching recency or the hit counters."""
+        self._expire()
+        return session_id in self._entries
+
+    def get(self, session_id: Optional[str]) -> Optional[UploadSession]:
+        self._expire()
+        session = self._entries.get(session_id) if session_id else None
+        if session is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        session.last_access = time.monotonic()
+        self._entries.move_to_end(session_id)
+        return session
+
+    def put(self, session: UploadSession) -> bool:
+        if not self.admits(session.memory):
+            self.rejected += 1
+            return False
+        if session.session_id in self._entries:
+            self._drop(session.session_id)
+        while self._entries and (
+            self.bytes_used + session.memory > self.max_bytes or len(self._entries) >= self.max_sessions
+        ):
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+        self._entries[session.session_id] = session
+        self.bytes_used += session.memory
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        self._expire()
+        return {
+            "sessions": len(self._entries),
+            "bytes": self.bytes_used,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "rejected": self.rejected,
+        }
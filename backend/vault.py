@@ -0,0 +1,207 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, Optional
+
+from ingest import map_upload
+from metrics import log_event
+
+# THE VAULT: CONTENT-ADDRESSED SIPHON ARCHIVE
+# Every archived payload is hashed and stored once as a blob:
+#
+#   vault/blobs/<sha[:2]>/<sha>[.gz]   unique content, gzipped unless already compressed
+#   vault/index.jsonl                  one line per archival event -> blob
+#
+# Identical re-uploads (every /refine-stream batch re-sends the same export)
+# only add an index line. All hashing, compression and disk writes run on a
+# background thread, never inside the request coroutine.
+
+COPY_CHUNK = 1024 * 1024
+PRECOMPRESSED = (".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z")
+
+
+class _Pinned:
+    """A read-only handle on upload bytes that outlives the request's file object.
+
+    Disk-backed uploads are memory-mapped, so archival hashes and copies the
+    spooled file's pages in place while the request keeps using (or closes)
+    its own handle. Small in-memory uploads are copied.
+    """
+
+    def __init__(self, raw: BinaryIO):
+        self.data: Optional[bytes] = None
+        self.map = map_upload(raw)
+        if self.map is not None:
+            return
+        if isinstance(raw, tempfile.SpooledTemporaryFile) and not getattr(raw, "_rolled", True):
+            self.data = raw._file.getvalue()
+            return
+        position = raw.tell()
+        raw.seek(0)
+        self.data = raw.read()
+        raw.seek(position)
+
+    @property
+    def buffer(self) -> Any:
+        return self.map if self.map is not None else self.data
+
+    def chunks(self) -> Iterator[bytes]:
+        buffer = self.buffer
+        if self.data is not None:
+            yield buffer
+            return
+        for offset in range(0, len(buffer), COPY_CHUNK):
+            yield buffer[offset:offset + COPY_CHUNK]
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.data = None
+
+
+class Vault:
+    def __init__(self, root: str = "vault", compress: bool = True):
+        self.root = root
+        self.compress = compress
+        self.blob_dir = os.path.join(root, "blobs")
+        self.tmp_dir = os.path.join(root, "tmp")
+        self.index_path = os.path.join(root, "index.jsonl")
+        self.stored = 0
+        self.deduplicated = 0
+        self.bytes_stored = 0
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vault")
+
+    # --- BLOB STORE ---
+
+    def _blob_path(self, digest: str, compressed: bool) -> str:
+        return os.path.join(self.blob_dir, digest[:2], digest + (".gz" if compressed else ""))
+
+    def _existing_blob(self, digest: str) -> Optional[str]:
+        for compressed in (True, False):
+            path = self._blob_path(digest, compressed)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _should_compress(self, filename: Optional[str]) -> bool:
+        return self.compress and not (filename or "").lower().endswith(PRECOMPRESSED)
+
+    def _commit(self, kind: str, filename: Optional[str], digest: str, size: int, spooled: Optional[str] = None, source: Optional[_Pinned] = None) -> Dict[str, Any]:
+        """Store one payload under its digest (unless already present) and index it."""
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        blob = self._existing_blob(digest)
+        deduplicated = blob is not None
+        if deduplicated:
+            if spooled:
+                os.remove(spooled)
+        else:
+            compressed = self._should_compress(filename)
+            blob = self._blob_path(digest, compressed)
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            staging = os.path.join(self.tmp_dir, f"{uuid.uuid4().hex}.blob")
+            if compressed:
+                with gzip.open(staging, "wb", compresslevel=6) as out:
+                    if spooled:
+                        with open(spooled, "rb") as src:
+                            shutil.copyfileobj(src, out, COPY_CHUNK)
+                    else:
+                        for chunk in source.chunks():
+                            out.write(chunk)
+                if spooled:
+                    os.remove(spooled)
+            elif spooled:
+                staging = spooled
+            else:
+                with open(staging, "wb") as out:
+                    for chunk in source.chunks():
+                        out.write(chunk)
+            os.replace(staging, blob)
+
+        record = {
+            "ts": int(time.time()),
+            "kind": kind,
+            "filename": filename,
+            "sha256": digest,
+            "size": size,
+            "blob": os.path.relpath(blob, self.root),
+            "deduplicated": deduplicated,
+        }
+        with self._lock:
+            if deduplicated:
+                self.deduplicated += 1
+            else:
+                self.stored += 1
+                self.bytes_stored += os.path.getsize(blob)
+            with open(self.index_path, "a", encoding="utf-8") as index:
+                index.write(json.dumps(record) + "\n")
+        return record
+
+    def _archive_pinned(self, kind: str, filename: Optional[str], source: _Pinned) -> Dict[str, Any]:
+        try:
+            # Hash first: a duplicate costs one pass over the pages and zero writes
+            buffer = source.buffer
+            digest = hashlib.sha256(buffer).hexdigest()
+            return self._commit(kind, filename, digest, len(buffer), source=source)
+        finally:
+            source.close()
+
+    # --- PUBLIC API ---
+
+    def archive_upload(self, kind: str, filename: Optional[str], raw: BinaryIO) -> Future:
+        """Queue an upload for archival and return immediately."""
+        source = _Pinned(raw)
+        future = self._writer.submit(self._archive_pinned, kind, filename, source)
+        future.add_done_callback(self._report)
+        return future
+
+    def tee(self, chunks: Iterable[bytes], kind: str, filename: Optional[str]) -> Iterator[bytes]:
+        """Pass a response body through while spooling it; dedup + store happen in the background."""
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        spooled = os.path.join(self.tmp_dir, f"{uuid.uuid4().hex}.part")
+        digest = hashlib.sha256()
+        size = 0
+        completed = False
+        try:
+            with open(spooled, "wb") as out:
+                for chunk in chunks:
+                    out.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+                    yield chunk
+            completed = True
+        finally:
+            if completed:
+                future = self._writer.submit(self._commit, kind, filename, digest.hexdigest(), size, spooled)
+                future.add_done_callback(self._report)
+            elif os.path.exists(spooled):
+                os.remove(spooled)
+
+    @staticmethod
+    def _report(future: Future):
+        try:
+            record = future.result()
+        except Exception as e:
+            log_event("vault_error", error=str(e))
+            return
+        state = "deduplicated" if record["deduplicated"] else "stored"
+        log_event(f"siphon_{state}", kind=record["kind"], filename=record["filename"], blob=record["blob"], size=record["size"])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "stored": self.stored,
+            "deduplicated": self.deduplicated,
+            "bytes_stored": self.bytes_stored,
+        }
+
+    def shutdown(self):
+        # Drain queued archival before the process exits
+        self._writer.shutdown(wait=True)
@@ -0,0 +1,221 @@
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Executor, Future
+from typing import Callable, Deque, Iterable, Iterator, List, Optional, Tuple, Union
+
+# THE CONVEYOR: STREAMING ZIP OUTPUT
+# Entries are compressed and emitted as soon as each conversation is refined.
+# The archive is never held whole: a bounded window of entries is in flight,
+# and the client sees bytes after the first one.
+#
+# DEFLATE runs on a thread pool (zlib releases the GIL). Entries are cut into
+# CHUNK_BYTES slices compressed independently, pigz style: each slice is primed
+# with the previous 32 KiB as a dictionary and ends on a sync flush, so the
+# concatenation is one valid deflate stream and one big conversation still
+# spreads across every core. Output order is always input order.
+#
+#   store      no compression, CRC only (fastest turnaround)
+#   balanced   zlib level 6 (the zipfile default)
+#   max        zlib level 9
+
+PROFILES = {"store": None, "balanced": 6, "max": 9}
+
+CHUNK_BYTES = 512 * 1024
+DICT_BYTES = 32 * 1024
+WINDOW_BYTES = 32 * 1024 * 1024
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FILECOUNT_LIMIT = 0xFFFF
+# Earliest date a zip header can hold; the fixed stamp for reproducible archives
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+EntryContent = Union[str, bytes, Iterable[Union[str, bytes]]]
+
+
+def _pieces(content: EntryContent) -> Iterator[bytes]:
+    if isinstance(content, (str, bytes)):
+        content = (content,)
+    for piece in content:
+        yield piece.encode("utf-8") if isinstance(piece, str) else piece
+
+
+def _slices(content: EntryContent) -> Iterator[bytes]:
+    """Re-cut an entry's pieces into CHUNK_BYTES slices as they arrive; never the whole entry at once."""
+    buffer = bytearray()
+    for piece in _pieces(content):
+        if not buffer and len(piece) == CHUNK_BYTES:
+            yield piece
+            continue
+        buffer += piece
+        while len(buffer) >= CHUNK_BYTES:
+            yield bytes(buffer[:CHUNK_BYTES])
+            del buffer[:CHUNK_BYTES]
+    if buffer:
+        yield bytes(buffer)
+
+
+def _submit(executor: Optional[Executor], fn: Callable, *args) -> Future:
+    if executor is not None:
+        return executor.submit(fn, *args)
+    future: Future = Future()
+    try:
+        future.set_result(fn(*args))
+    except BaseException as exc:
+        future.set_exception(exc)
+    return future
+
+
+def _deflate(data: bytes, level: int, zdict: Optional[bytes], final: bool) -> bytes:
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+def _dos_time(date_time: Tuple[int, ...]) -> Tuple[int, int]:
+    year, month, day, hour, minute, second = date_time[:6]
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+
+class _Entry:
+    """One entry in flight: sliced as its content arrives, each slice deflated on the pool.
+
+    The CRC is chained over the slices on the caller (zlib releases the GIL for it too).
+    """
+
+    def __init__(self, name: str, content: EntryContent, level: Optional[int], executor: Optional[Executor]):
+        self.name = name
+        self.size = 0
+        self.crc = 0
+        self.method = ZIP_STORED if level is None else ZIP_DEFLATED
+        self.slices: List[Future] = []
+        previous: Optional[bytes] = None
+        zdict: Optional[bytes] = None
+        for piece in _slices(content):
+            self.size += len(piece)
+            self.crc = zlib.crc32(piece, self.crc)
+            if level is None:
+                # Stored: the slice is its own payload
+                self.slices.append(_submit(None, bytes, piece))
+                continue
+            # One slice is held back so the last one can end the stream with Z_FINISH
+            if previous is not None:
+                self.slices.append(_submit(executor, _deflate, previous, level, zdict, False))
+                zdict = previous[-DICT_BYTES:]
+            previous = piece
+        if level is not None:
+            self.slices.append(_submit(executor, _deflate, previous or b"", level, zdict, True))
+
+    def ready(self) -> bool:
+        return all(future.done() for future in self.slices)
+
+    def payload(self) -> List[bytes]:
+        return [future.result() for future in self.slices]
+
+    def cancel(self):
+        for future in self.slices:
+            future.cancel()
+
+
+class _Directory:
+    """Local headers and the central directory, ZIP64 where sizes or counts need it."""
+
+    def __init__(self, date_time: Tuple[int, ...]):
+        self.time, self.date = _dos_time(date_time)
+        self.records: List[bytes] = []
+        self.offset = 0
+
+    def local_header(self, entry: _Entry, crc: int, compressed: int) -> bytes:
+        name = entry.name.encode("utf-8")
+        flags = 0x800 if not entry.name.isascii() else 0
+        zip64 = entry.size >= ZIP64_LIMIT or compressed >= ZIP64_LIMIT
+        extra = struct.pack("<HHQQ", 0x0001, 16, entry.size, compressed) if zip64 else b""
+        version = 45 if zip64 else 20
+        header = struct.pack(
+            "<IHHHHHIIIHH", 0x04034B50, version, flags, entry.method, self.time, self.date, crc,
+            ZIP64_LIMIT if zip64 else compressed, ZIP64_LIMIT if zip64 else entry.size, len(name), len(extra),
+        ) + name + extra
+
+        central_extra = b""
+        fields = []
+        if entry.size >= ZIP64_LIMIT:
+            fields.append(entry.size)
+        if compressed >= ZIP64_LIMIT:
+            fields.append(compressed)
+        if self.offset >= ZIP64_LIMIT:
+            fields.append(self.offset)
+        if fields:
+            central_extra = struct.pack(f"<HH{len(fields)}Q", 0x0001, 8 * len(fields), *fields)
+            version = 45
+        self.records.append(struct.pack(
+            "<IHHHHHHIIIHHHHHII", 0x02014B50, (3 << 8) | version, version, flags, entry.method, self.time, self.date, crc,
+            min(compressed, ZIP64_LIMIT), min(entry.size, ZIP64_LIMIT), len(name), len(central_extra), 0, 0, 0,
+            0o600 << 16, min(self.offset, ZIP64_LIMIT),
+        ) + name + central_extra)
+        self.offset += len(header) + compressed
+        return header
+
+    def end(self) -> bytes:
+        directory = b"".join(self.records)
+        count, start, size = len(self.records), self.offset, len(directory)
+        tail = b""
+        if count > ZIP_FILECOUNT_LIMIT or start >= ZIP64_LIMIT or size >= ZIP64_LIMIT:
+            end64 = start + size
+            tail = struct.pack("<IQHHIIQQQQ", 0x06064B50, 44, 45, 45, 0, 0, count, count, size, start)
+            tail += struct.pack("<IIQI", 0x07064B50, 0, end64, 1)
+        tail += struct.pack(
+            "<IHHHHIIH", 0x06054B50, 0, 0, min(count, ZIP_FILECOUNT_LIMIT), min(count, ZIP_FILECOUNT_LIMIT),
+            min(size, ZIP64_LIMIT), min(start, ZIP64_LIMIT), 0,
+        )
+        return directory + tail
+
+
+def stream_zip(
+    entries: Iterable[Tuple[str, EntryContent]],
+    profile: str = "balanced",
+    executor: Optional[Executor] = None,
+    workers: int = 1,
+    date_time: Optional[Tuple[int, ...]] = None,
+) -> Iterator[bytes]:
+    """Yield a zip archive chunk by chunk from lazily produced (name, content) entries.
+
+    executor=None compresses inline on the caller; pass a thread pool to use
+    every core, with workers set to its size (it sizes the in-flight window).
+    Entries are stamped with the current time unless date_time fixes it, which
+    makes the same entries produce the same bytes.
+    """
+    level = PROFILES.get(profile, PROFILES["balanced"])
+    directory = _Directory(date_time or time.localtime(time.time()))
+    # Upper bound on entries in flight; the head goes out as soon as it is compressed
+    window = max(2, 2 * workers) if executor is not None else 2
+    pending: Deque[_Entry] = deque()
+    in_flight = 0
+
+    def emit(entry: _Entry) -> Iterator[bytes]:
+        payload = entry.payload()
+        yield directory.local_header(entry, entry.crc, sum(len(part) for part in payload))
+        yield from payload
+
+    try:
+        for name, content in entries:
+            entry = _Entry(name, content, level, executor)
+            pending.append(entry)
+            in_flight += entry.size
+            while pending and (
+                pending[0].ready() or len(pending) > window or (len(pending) > 1 and in_flight > WINDOW_BYTES)
+            ):
+                head = pending.popleft()
+                in_flight -= head.size
+                yield from emit(head)
+        while pending:
+            yield from emit(pending.popleft())
+    finally:
+        for entry in pending:
+            entry.cancel()
+    # Central directory
+    yield directory.end()
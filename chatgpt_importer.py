@@ -1,9 +1,11 @@
 """ChatGPT import service for Basic Memory."""
 
+import asyncio
 import logging
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Set
+from typing import Any, Dict, List, Optional, Set, Tuple
 
+from backend.chatgpt_tree import ConversationTree
 from basic_memory.markdown.schemas import EntityFrontmatter, EntityMarkdown
 from basic_memory.importers.base import Importer
 from basic_memory.schemas.importer import ChatImportResult
@@ -11,6 +13,9 @@ from basic_memory.importers.utils import clean_filename, format_timestamp
 
 logger = logging.getLogger(__name__)
 
+# Files written concurrently while later chats are still being formatted
+DEFAULT_WRITE_CONCURRENCY = 16
+
 
 class ChatGPTImporter(Importer[ChatImportResult]):
     """Service for importing ChatGPT conversations."""
@@ -20,44 +25,66 @@ class ChatGPTImporter(Importer[ChatImportResult]):
     ) -> ChatImportResult:
         """Import conversations from ChatGPT JSON export.
 
+        Each chat is formatted in a single traversal that also counts its
+        messages, then written while the next chats are formatted, with at
+        most ``write_concurrency`` writes in flight.
+
         Args:
             source_path: Path to the ChatGPT conversations.json file.
             destination_folder: Destination folder within the project.
-            **kwargs: Additional keyword arguments.
+            **kwargs: Additional keyword arguments. ``write_concurrency``
+                bounds concurrent file writes (default 16).
 
         Returns:
             ChatImportResult containing statistics and status of the import.
         """
+        pending: Set[asyncio.Task] = set()
         try:  # pragma: no cover
             # Ensure the destination folder exists
             self.ensure_folder_exists(destination_folder)
             conversations = source_data
+            write_slots = asyncio.Semaphore(
+                max(1, int(kwargs.get("write_concurrency", DEFAULT_WRITE_CONCURRENCY)))
+            )
+            failures: List[BaseException] = []
+
+            async def write(entity: EntityMarkdown) -> None:
+                try:
+                    file_path = self.base_path / f"{entity.frontmatter.metadata['permalink']}.md"
+                    await self.write_entity(entity, file_path)
+                finally:
+                    write_slots.release()
+
+            def written(task: asyncio.Task) -> None:
+                pending.discard(task)
+                if not task.cancelled() and task.exception() is not None:
+                    failures.append(task.exception())
 
             # Process each conversation
             messages_imported = 0
             chats_imported = 0
+            # Permalinks are assigned in export order, so collisions resolve
+            # the same way on every run regardless of write completion order
+            permalinks: Dict[str, int] = {}
 
             for chat in conversations:
-                # Convert to entity
-                entity = self._format_chat_content(destination_folder, chat)
-
-                # Write file
-                file_path = self.base_path / f"{entity.frontmatter.metadata['permalink']}.md"
-                await self.write_entity(entity, file_path)
-
-                # Count messages
-                msg_count = sum(
-                    1
-                    for node in chat["mapping"].values()
-                    if node.get("message")
-                    and not node.get("message", {})
-                    .get("metadata", {})
-                    .get("is_visually_hidden_from_conversation")
-                )
+                # Convert to entity (counting messages on the way)
+                entity, msg_count = self._format_chat_content(destination_folder, chat, permalinks)
+
+                # Write file, waiting only when write_concurrency writes are in flight
+                await write_slots.acquire()
+                if failures:
+                    write_slots.release()
+                    raise failures[0]
+                task = asyncio.create_task(write(entity))
+                pending.add(task)
+                task.add_done_callback(written)
 
                 chats_imported += 1
                 messages_imported += msg_count
 
+            await asyncio.gather(*pending)
+
             return ChatImportResult(
                 import_count={"conversations": chats_imported, "messages": messages_imported},
                 success=True,
@@ -69,38 +96,66 @@ class ChatGPTImporter(Importer[ChatImportResult]):
             logger.exception("Failed to import ChatGPT conversations")
             return self.handle_error("Failed to import ChatGPT conversations", e)  # pyright: ignore [reportReturnType]
 
+        finally:
+            for task in list(pending):
+                task.cancel()
+
+    def _unique_permalink(self, permalink: str, permalinks: Dict[str, int]) -> str:
+        """Suffix repeated permalinks with -2, -3, ... in the order they are seen.
+
+        Args:
+            permalink: Permalink derived from the chat's date and title.
+            permalinks: Permalinks assigned so far in this import, mapped to
+                the next suffix to try.
+
+        Returns:
+            A permalink not yet used in this import.
+        """
+        if permalink not in permalinks:
+            permalinks[permalink] = 2
+            return permalink
+        suffix = permalinks[permalink]
+        # A title may already end in "-2"; skip suffixes taken by another chat
+        while f"{permalink}-{suffix}" in permalinks:
+            suffix += 1
+        permalinks[permalink] = suffix + 1
+        candidate = f"{permalink}-{suffix}"
+        permalinks[candidate] = 2
+        return candidate
+
     def _format_chat_content(
-        self, folder: str, conversation: Dict[str, Any]
-    ) -> EntityMarkdown:  # pragma: no cover
+        self,
+        folder: str,
+        conversation: Dict[str, Any],
+        permalinks: Optional[Dict[str, int]] = None,
+    ) -> Tuple[EntityMarkdown, int]:  # pragma: no cover
         """Convert chat conversation to Basic Memory entity.
 
         Args:
             folder: Destination folder name.
             conversation: ChatGPT conversation data.
+            permalinks: Permalinks already assigned in this import; a repeated
+                permalink gets a numeric suffix.
 
         Returns:
-            EntityMarkdown instance representing the conversation.
+            EntityMarkdown instance representing the conversation, and the
+            number of visible messages it contains.
         """
         # Extract timestamps
         created_at = conversation["create_time"]
         modified_at = conversation["update_time"]
 
-        root_id = None
-        # Find root message
-        for node_id, node in conversation["mapping"].items():
-            if node.get("parent") is None:
-                root_id = node_id
-                break
-
         # Generate permalink
         date_prefix = datetime.fromtimestamp(created_at).strftime("%Y%m%d")
         clean_title = clean_filename(conversation["title"])
+        permalink = f"{folder}/{date_prefix}-{clean_title}"
+        if permalinks is not None:
+            permalink = self._unique_permalink(permalink, permalinks)
 
         # Format content
-        content = self._format_chat_markdown(
+        content, msg_count = self._format_chat_markdown(
             title=conversation["title"],
             mapping=conversation["mapping"],
-            root_id=root_id,
             created_at=created_at,
             modified_at=modified_at,
         )
@@ -113,46 +168,45 @@ class ChatGPTImporter(Importer[ChatImportResult]):
                     "title": conversation["title"],
                     "created": format_timestamp(created_at),
                     "modified": format_timestamp(modified_at),
-                    "permalink": f"{folder}/{date_prefix}-{clean_title}",
+                    "permalink": permalink,
                 }
             ),
             content=content,
         )
 
-        return entity
+        return entity, msg_count
 
     def _format_chat_markdown(
         self,
         title: str,
         mapping: Dict[str, Any],
-        root_id: Optional[str],
         created_at: float,
         modified_at: float,
-    ) -> str:  # pragma: no cover
-        """Format chat as clean markdown.
+    ) -> Tuple[str, int]:  # pragma: no cover
+        """Format chat as clean markdown, counting visible messages on the way.
 
         Args:
             title: Chat title.
             mapping: Message mapping.
-            root_id: Root message ID.
             created_at: Creation timestamp.
             modified_at: Modification timestamp.
 
         Returns:
-            Formatted markdown content.
+            Formatted markdown content and the number of visible messages.
         """
         # Start with title
         lines = [f"# {title}\n"]
+        msg_count = 0
 
         # Traverse message tree
-        seen_msgs: Set[str] = set()
-        messages = self._traverse_messages(mapping, root_id, seen_msgs)
+        messages = self._traverse_messages(mapping)
 
         # Format each message
         for msg in messages:
             # Skip hidden messages
             if msg.get("metadata", {}).get("is_visually_hidden_from_conversation"):
                 continue
+            msg_count += 1
 
             # Get author and timestamp
             author = msg["author"]["role"].title()
@@ -169,7 +223,7 @@ class ChatGPTImporter(Importer[ChatImportResult]):
             # Add spacing
             lines.append("")
 
-        return "\n".join(lines)
+        return "\n".join(lines), msg_count
 
     def _get_message_content(self, message: Dict[str, Any]) -> str:  # pragma: no cover
         """Extract clean message content.
@@ -190,33 +244,16 @@ class ChatGPTImporter(Importer[ChatImportResult]):
             return f"```{content.get('language', '')}\n{content.get('text', '')}\n```"
         return ""
 
-    def _traverse_messages(
-        self, mapping: Dict[str, Any], root_id: Optional[str], seen: Set[str]
-    ) -> List[Dict[str, Any]]:  # pragma: no cover
+    def _traverse_messages(self, mapping: Dict[str, Any]) -> List[Dict[str, Any]]:  # pragma: no cover
         """Traverse message tree and return messages in order.
 
+        Every branch is walked depth first, iteratively, with shared prefixes
+        emitted once.
+
         Args:
             mapping: Message mapping.
-            root_id: Root message ID.
-            seen: Set of seen message IDs.
 
         Returns:
             List of message data.
         """
-        messages = []
-        node = mapping.get(root_id) if root_id else None
-
-        while node:
-            if node["id"] not in seen and node.get("message"):
-                seen.add(node["id"])
-                messages.append(node["message"])
-
-            # Follow children
-            children = node.get("children", [])
-            for child_id in children:
-                child_msgs = self._traverse_messages(mapping, child_id, seen)
-                messages.extend(child_msgs)
-
-            break  # Don't follow siblings
-
-        return messages
+        return [message for message, _ in ConversationTree(mapping).messages("all_branches")]
@@ -41,6 +41,16 @@ const DEFAULT_PERSONAS: Persona[] = [
 
 import { ProcessingAdModal } from '@/components/ProcessingAdModal';
 
+type BatchRange = { start: number, end: number };
+
+// BATCH PAGING: the server reports where a batch really ended (cost budget, not
+// a fixed 20), so later ranges are re-cut from there; the last one is a guess
+const nextBatchRanges = (prev: BatchRange[], start: number, nextIndex: number): BatchRange[] => [
+  ...prev.filter(r => r.end <= start),
+  { start, end: nextIndex },
+  ...(nextIndex < 500 ? [{ start: nextIndex, end: nextIndex + 20 }] : []),
+];
+
 // GHOST TERMINAL (PORTED FROM PERSONAL EDITION)
 const GhostTerminal = ({ telemetry }: { telemetry: any[] }) => (
   <div className="absolute inset-0 pointer-events-none opacity-[0.3] overflow-hidden z-0 select-none flex flex-col justify-end p-10">
@@ -82,7 +92,7 @@ export default function CommandDeck() {
   const [showAdGate, setShowAdGate] = useState(false);
   const [personality, setPersonality] = useState<'SIPHON' | 'TOLL'>('TOLL');
   const [mountedTime, setMountedTime] = useState("");
-  const [batchRanges, setBatchRanges] = useState<{ start: number, end: number }[]>([]);
+  const [batchRanges, setBatchRanges] = useState<BatchRange[]>([]);
 
   const [batchProgress, setBatchProgress] = useState<('IDLE' | 'PROCESSING' | 'COMPLETE')[]>(Array(20).fill('IDLE'));
   const [processedFileNames, setProcessedFileNames] = useState<string[]>(Array(20).fill(""));
@@ -108,6 +118,7 @@ export default function CommandDeck() {
 
   const fileInputRef = useRef<HTMLInputElement>(null);
   const abortControllerRef = useRef<AbortController | null>(null);
+  const sessionIdRef = useRef<string | null>(null); // PARSED UPLOAD SESSION (skips server re-parse on later batches)
   const logContainerRef = useRef<HTMLDivElement>(null);
 
   // Use a state for API_BASE to avoid hydration mismatch
@@ -196,6 +207,7 @@ export default function CommandDeck() {
       setBatchNames(extractedNames.slice(0, 20));
       setBatchRanges(ranges);
       setStartIndex(0);
+      sessionIdRef.current = null;
     } catch (e) {
       setBatchRanges([{ start: 0, end: 20 }]);
       setBatchNames(Array(20).fill("BINARY_STREAM"));
@@ -216,6 +228,8 @@ export default function CommandDeck() {
       let allNames: string[] = [];
 
       for (const f of droppedFiles) {
+        // Export zips are unpacked server-side; the count arrives with the start event
+        if (f.name.toLowerCase().endsWith('.zip')) continue;
         try {
           const text = await f.text();
           if (droppedFiles.length === 1) setFileContent(text); // Only show text if single file
@@ -258,6 +272,8 @@ export default function CommandDeck() {
       let allNames: string[] = [];
 
       for (const f of selectedFiles) {
+        // Export zips are unpacked server-side; the count arrives with the start event
+        if (f.name.toLowerCase().endsWith('.zip')) continue;
         try {
           const text = await f.text();
           if (selectedFiles.length === 1) setFileContent(text);
@@ -305,7 +321,7 @@ export default function CommandDeck() {
     addTelemetry(isSiphon ? "[⚙️] PREPARING_ARCHIVAL_STREAM..." : "[⚙️] INITIALIZING_REFINERY_ENGINE...");
 
     const baseName = file.name.replace(/\.[^/.]+$/, "");
-    const strikeOptions = { ...options, base_filename: baseName };
+    const strikeOptions = { ...options, base_filename: baseName, message_chunks: true };
 
     const formData = new FormData();
     // MULTI-FILE PAYLOAD
@@ -314,9 +330,10 @@ export default function CommandDeck() {
     });
     formData.append('options_json', JSON.stringify(strikeOptions));
     formData.append('start_index', startIndex.toString());
+    if (sessionIdRef.current) formData.append('session_id', sessionIdRef.current);
 
     try {
-      const response = await fetch(`${apiBase}/refine-stream`, {
+      let response = await fetch(`${apiBase}/refine-stream`, {
         method: 'POST',
         body: formData,
         signal: abortControllerRef.current.signal
@@ -324,74 +341,116 @@ export default function CommandDeck() {
 
       if (!response.ok) throw new Error(`STRIKE_FAILED: ${response.statusText}`);
 
-      const reader = response.body?.getReader();
+      // The batch runs as a server-side job: if the stream drops, re-attach and
+      // replay from the last event we handled instead of refining it again
+      const jobId = response.headers.get('X-Washhouse-Job');
       const decoder = new TextDecoder();
-      let buffer = "";
       const allMessages: Message[] = [];
+      let lastEventId = -1;
+      let finished = false;
+      let reconnects = 0;
 
-      if (reader) {
-        while (true) {
-          const { done, value } = await reader.read();
-          if (done) break;
-
-          buffer += decoder.decode(value, { stream: true });
-          const lines = buffer.split('\n\n');
-          buffer = lines.pop() || "";
-
-          for (const line of lines) {
-            if (line.startsWith('data: ')) {
-              try {
-                const data = JSON.parse(line.slice(6));
-                if (data.status === 'start') {
-                  // FORCE UPDATE NAMES FROM BACKEND TO FIX BLANK LIST
-                  if (data.batch_names && Array.isArray(data.batch_names)) {
-                    const incomingNames = [...data.batch_names];
-                    // Pad if needed
-                    while (incomingNames.length < 20) incomingNames.push("");
-                    setBatchNames(incomingNames);
-                  }
-                  addTelemetry(isSiphon ? `[📡] EXTRACTION_STARTED: ${data.total} ASSETS` : `[📡] REFINERY_STRIKE_CONFIRMED: ${data.total} TARGETS_LOCKED`, "success");
-                } else if (data.status === 'welded') {
-                  const msg = isSiphon ? `PROCESSED: ${data.name.toUpperCase()}` : `WELDED: [${data.name.toUpperCase()}] // MSGS: ${data.msg_count}`;
-                  addTelemetry(msg, "success");
-                  allMessages.push(...data.messages);
-                  setRefinedMessages([...allMessages]);
-                  setProgress(Math.round((data.index / data.total) * 100));
-
-                  setBatchProgress(prev => {
-                    const next = [...prev];
-                    const idx = data.index - 1;
-                    if (idx >= 0 && idx < 20) {
-                      next[idx] = 'COMPLETE';
-                      setProcessedFileNames(prevNames => {
-                        const nextNames = [...prevNames];
-                        nextNames[idx] = data.name;
-                        return nextNames;
-                      });
-                      if (idx + 1 < 20) {
-                        next[idx + 1] = 'PROCESSING';
-                        next[idx + 1] = 'PROCESSING';
-                      }
+      while (true) {
+        const reader = response.body?.getReader();
+        let buffer = "";
+        try {
+          if (reader) {
+            while (true) {
+              const { done, value } = await reader.read();
+              if (done) break;
+
+              buffer += decoder.decode(value, { stream: true });
+              const frames = buffer.split('\n\n');
+              buffer = frames.pop() || "";
+
+              for (const frame of frames) {
+                const fields = frame.split('\n');
+                const line = fields.find(f => f.startsWith('data: '));
+                const idField = fields.find(f => f.startsWith('id: '));
+                // Keepalive comments carry no data
+                if (!line) continue;
+                try {
+                  const data = JSON.parse(line.slice(6));
+                  if (data.status === 'complete' || data.status === 'error') finished = true;
+                  if (data.status === 'start') {
+                    if (data.session_id) sessionIdRef.current = data.session_id;
+                    if (Array.isArray(data.batches)) {
+                      // Cost-planned boundaries from the server replace the fixed 20-chat slices
+                      setBatchRanges(data.batches
+                        .filter(([start]: [number, number]) => start < 500)
+                        .map(([start, end]: [number, number]) => ({ start, end })));
+                    } else if (typeof data.next_index === 'number') {
+                      // Streamed uploads have no plan: this batch ended at next_index,
+                      // so the next one starts there (its own end is still unknown)
+                      setBatchRanges(prev => nextBatchRanges(prev, startIndex, data.next_index));
+                    }
+                    // FORCE UPDATE NAMES FROM BACKEND TO FIX BLANK LIST
+                    if (data.batch_names && Array.isArray(data.batch_names)) {
+                      const incomingNames = [...data.batch_names];
+                      // Pad if needed
+                      while (incomingNames.length < 20) incomingNames.push("");
+                      setBatchNames(incomingNames);
                     }
-                    return next;
-                  });
-
-                } else if (data.status === 'complete') {
-                  addTelemetry(isSiphon ? "[✔️] ARCHIVAL_COMPLETE" : "[✔️] REFINERY_STRIKE_SUCCESSFUL", "success");
-                  addTelemetry(isSiphon ? "[📦] ASSETS_PERSISTED_IN_VAULT" : "[📦] PAYLOAD_COMPRESSED_AND_DELIVERED", "success");
-                  setProgress(100);
-                  setBatchProgress(prev => prev.map(s => s === 'PROCESSING' ? 'COMPLETE' : s));
-                } else if (data.status === 'error') {
-                  addTelemetry(`[❌] REFINERY_MALFUNCTION: ${data.message.toUpperCase()}`, "warn");
-                  setIsProcessing(false);
+                    addTelemetry(isSiphon ? `[📡] EXTRACTION_STARTED: ${data.total} ASSETS` : `[📡] REFINERY_STRIKE_CONFIRMED: ${data.total} TARGETS_LOCKED`, "success");
+                  } else if (data.status === 'chunk') {
+                    // Giant conversations stream in pieces; the 'welded' marker follows the last one
+                    allMessages.push(...data.messages);
+                    setRefinedMessages([...allMessages]);
+                  } else if (data.status === 'welded') {
+                    const msg = isSiphon ? `PROCESSED: ${data.name.toUpperCase()}` : `WELDED: [${data.name.toUpperCase()}] // MSGS: ${data.msg_count}`;
+                    addTelemetry(msg, "success");
+                    allMessages.push(...data.messages);
+                    setRefinedMessages([...allMessages]);
+                    setProgress(Math.round((data.index / data.total) * 100));
+
+                    setBatchProgress(prev => {
+                      const next = [...prev];
+                      const idx = data.index - 1;
+                      if (idx >= 0 && idx < 20) {
+                        next[idx] = 'COMPLETE';
+                        setProcessedFileNames(prevNames => {
+                          const nextNames = [...prevNames];
+                          nextNames[idx] = data.name;
+                          return nextNames;
+                        });
+                        if (idx + 1 < 20) {
+                          next[idx + 1] = 'PROCESSING';
+                          next[idx + 1] = 'PROCESSING';
+                        }
+                      }
+                      return next;
+                    });
+
+                  } else if (data.status === 'complete') {
+                    addTelemetry(isSiphon ? "[✔️] ARCHIVAL_COMPLETE" : "[✔️] REFINERY_STRIKE_SUCCESSFUL", "success");
+                    addTelemetry(isSiphon ? "[📦] ASSETS_PERSISTED_IN_VAULT" : "[📦] PAYLOAD_COMPRESSED_AND_DELIVERED", "success");
+                    setProgress(100);
+                    setBatchProgress(prev => prev.map(s => s === 'PROCESSING' ? 'COMPLETE' : s));
+                  } else if (data.status === 'error') {
+                    addTelemetry(`[❌] REFINERY_MALFUNCTION: ${data.message.toUpperCase()}`, "warn");
+                    setIsProcessing(false);
+                  }
+                } catch (e) {
+                  console.error("Parse error:", e);
+                  addTelemetry("[⚠️] FRAGMENTED_PACKET_DROPPED", "warn");
                 }
-              } catch (e) {
-                console.error("Parse error:", e);
-                addTelemetry("[⚠️] FRAGMENTED_PACKET_DROPPED", "warn");
+                if (idField) lastEventId = parseInt(idField.slice(4), 10);
               }
             }
           }
+        } catch (error: any) {
+          if (error.name === 'AbortError' || !jobId) throw error;
         }
+        if (finished || !jobId || reconnects >= 5) break;
+
+        reconnects++;
+        addTelemetry(`[📡] UPLINK_DROPPED // RESUMING_FROM_EVENT_${lastEventId + 1}...`, "warn");
+        await new Promise(resolve => setTimeout(resolve, 1000 * reconnects));
+        response = await fetch(`${apiBase}/jobs/${jobId}/events`, {
+          headers: { 'Last-Event-ID': String(lastEventId) },
+          signal: abortControllerRef.current?.signal
+        });
+        if (!response.ok) throw new Error(`RESUME_FAILED: ${response.statusText}`);
       }
 
       setRefinedMessages(allMessages);
@@ -418,8 +477,11 @@ export default function CommandDeck() {
     fileList.forEach(f => formData.append('files', f));
     formData.append('options_json', JSON.stringify({ ...options, base_filename: brandedName }));
     formData.append('start_index', startIndex.toString());
+    if (sessionIdRef.current) formData.append('session_id', sessionIdRef.current);
     try {
       const zipResponse = await axios.post(`${apiBase}/refine`, formData, { responseType: 'blob' });
+      const nextIndex = Number(zipResponse.headers['x-washhouse-next-index']);
+      if (nextIndex > startIndex && !sessionIdRef.current) setBatchRanges(prev => nextBatchRanges(prev, startIndex, nextIndex));
       const url = window.URL.createObjectURL(new Blob([zipResponse.data]));
       const link = document.createElement('a');
       link.href = url;
@@ -592,7 +654,7 @@ export default function CommandDeck() {
                             {file.name.toLowerCase().includes('gemini') ? (
                               <>DETECTED: {file.name} // <span className="text-white">20 CHATS LOADED.</span> READY.</>
                             ) : (
-                              <>DETECTED: {file.name} // TOTAL_CAPACITY: {batchRanges.length * 20}+ // <span className="text-voltage animate-pulse">PICK BATCH TO PROCESS</span></>
+                              <>DETECTED: {file.name} // TOTAL_CAPACITY: {batchRanges.length ? batchRanges[batchRanges.length - 1].end : 0}+ // <span className="text-voltage animate-pulse">PICK BATCH TO PROCESS</span></>
                             )}
                           </div>
                         )}
@@ -608,7 +670,7 @@ export default function CommandDeck() {
                           ))}
                         </div>
                         <div className="text-[8px] text-hazard font-bold uppercase tracking-widest italic opacity-60">
-                          * STRIKE RANGE LOCKED: {startIndex + 1} TO {startIndex + 20}
+                          * STRIKE RANGE LOCKED: {startIndex + 1} TO {batchRanges.find(r => r.start === startIndex)?.end ?? startIndex + 20}
                         </div>
                       </div>
                     )}
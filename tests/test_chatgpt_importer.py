@@ -0,0 +1,29 @@
+import pytest
+
+pytest.importorskip("basic_memory")
+
+from chatgpt_importer import ChatGPTImporter  # noqa: E402
+
+
+def node(parent, children, role=None, text=None):
+    message = None
+    if role:
+        message = {"author": {"role": role}, "create_time": None, "content": {"content_type": "text", "parts": [text]}}
+    return {"parent": parent, "children": children, "message": message}
+
+
+# root -> question -> two regenerated answers (a fork)
+FORKED = {
+    "root": node(None, ["q"]),
+    "q": node("root", ["a1", "a2"], "user", "why?"),
+    "a1": node("q", [], "assistant", "first answer"),
+    "a2": node("q", [], "assistant", "second answer"),
+}
+
+
+def test_forked_mapping_formats_every_branch():
+    importer = ChatGPTImporter.__new__(ChatGPTImporter)
+    markdown, count = importer._format_chat_markdown("Forked", FORKED, 0, 0)
+    assert count == 3
+    assert "why?" in markdown
+    assert "first answer" in markdown and "second answer" in markdown